@@ -0,0 +1,7 @@
+import os
+import sys
+
+# 测试不写笔画日志、不启动延时回放进程池；模块按仓库根目录导入
+os.environ.setdefault("DRAWINGS_DIR", "")
+os.environ.setdefault("TIMELAPSE_WORKERS", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,694 @@
+import asyncio
+
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import tyf_match
+import tyf_multiplayer
+import tyf_ratelimit
+from tyf_backplane import BackplaneBroker, InProcessBackplane, SocketBackplane
+from tyf_guesser import GuesserService, LocalGuessBackend
+from tyf_match import CLOSE, CORRECT, WRONG, GuessMatcher, matcher_for, normalize
+from tyf_multiplayer import ClientConnection, GameState, Room, merge_strokes
+from tyf_ratelimit import RateLimiter, TokenBucket, coalesce_points
+from tyf_canvas import BGRCanvas
+from tyf_simplify import StrokeSimplifier, rdp
+from tyf_strokelog import RECORD_DTYPE, StrokeLog, read_log, replay
+from tyf_words import WordBank, WordDeck, cache_path_for, default_word_bank, load_word_bank
+
+async def wait_for(condition, timeout=2.0):
+    """等待条件成立，超时则测试失败"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "等待超时"
+        await asyncio.sleep(0.01)
+
+def drawing(i):
+    """每个i对应一幅不同的画面（JPEG数据）"""
+    image = np.full((120, 160, 3), 255, dtype=np.uint8)
+    cv2.rectangle(image, (10 + i * 10, 10), (40 + i * 10, 60), (0, 0, 0), -1)
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+def recorder(received, name):
+    async def handler(event):
+        received.append((name, event))
+    return handler
+
+def test_broker_fan_out(tmp_path):
+    """消息代理只把事件转发给订阅了同一房间的其他节点"""
+    async def run():
+        url = f"unix://{tmp_path / 'broker.sock'}"
+        broker = BackplaneBroker()
+        await broker.start(url)
+        nodes = [SocketBackplane(url) for _ in range(3)]
+        received = []
+        try:
+            for node in nodes:
+                await node.start()
+            nodes[0].subscribe("a", recorder(received, 0))
+            nodes[1].subscribe("a", recorder(received, 1))
+            nodes[2].subscribe("b", recorder(received, 2))
+            await wait_for(lambda: len(broker.subscribers.get("a", ())) == 2 and "b" in broker.subscribers)
+            await nodes[0].publish("a", {"op": "clear"})
+            await nodes[1].publish("a", {"op": "reset", "current_word": "猫"})
+            # 订阅了b的只有发布者自己，不会收到自己发布的事件
+            await nodes[2].publish("b", {"op": "clear"})
+            await wait_for(lambda: len(received) >= 2)
+            await asyncio.sleep(0.05)
+            assert sorted(received, key=lambda item: item[0]) == [
+                (0, {"op": "reset", "current_word": "猫"}),
+                (1, {"op": "clear"})
+            ]
+        finally:
+            for node in nodes:
+                await node.close()
+            await broker.close()
+    asyncio.run(run())
+
+def test_snapshot_sync_between_nodes():
+    """后加入的工作进程从已有的工作进程同步词语、猜测记录和画布"""
+    async def run():
+        hub = {}
+        first = Room("sync", InProcessBackplane(hub), simplify_tolerance=0)
+        first.start()
+        await first.wait_ready()
+        await wait_for(lambda: "sync" in hub)
+        first.draw_batch([(100, 100, True, (0, 0, 255)), (300, 200, True, None), (300, 200, False, None)])
+        first.game_state.add_guess("狗")
+
+        second = Room("sync", InProcessBackplane(hub), simplify_tolerance=0)
+        try:
+            second.start()
+            await wait_for(lambda: list(second.game_state.guesses) == list(first.game_state.guesses))
+            assert second.game_state.current_word == first.game_state.current_word
+            assert second.game_state.guess_seq == first.game_state.guess_seq
+            # 同步使用无损PNG，画布逐像素一致
+            assert np.array_equal(second.game_state.canvas, first.game_state.canvas)
+            assert first.game_state.canvas.min() < 255
+            # 已有的工作进程不会被后加入者的状态覆盖
+            assert not first.synced
+        finally:
+            first.close()
+            second.close()
+    asyncio.run(run())
+
+def test_guesser_batches_rooms():
+    """不同房间同时到达的请求合并为一批"""
+    async def run():
+        backend = LocalGuessBackend()
+        service = GuesserService(backend, batch_size=8, batch_wait=0.02)
+        try:
+            images = [drawing(i) for i in range(4)]
+            answers = await asyncio.gather(*(service.guess(f"room{i}", image) for i, image in enumerate(images)))
+            assert answers == [backend.guess(image) for image in images]
+            assert backend.calls == 1
+            assert service.batches == 1
+        finally:
+            service.close()
+    asyncio.run(run())
+
+def test_guesser_batch_size_and_room_concurrency():
+    """每批不超过batch_size，同一房间同时只有一个请求在进行"""
+    async def run():
+        backend = LocalGuessBackend()
+        service = GuesserService(backend, batch_size=2, batch_wait=0.02, room_concurrency=1)
+        try:
+            images = [drawing(i) for i in range(4)]
+            await asyncio.gather(*(service.guess("room", image) for image in images))
+            assert backend.calls == 4
+            backend.calls = 0
+            await asyncio.gather(*(service.guess(f"room{i}", drawing(i + 4)) for i in range(4)))
+            assert backend.calls == 2
+        finally:
+            service.close()
+    asyncio.run(run())
+
+def test_guesser_cache_and_shared_requests():
+    """画面和提示词相同的请求共享进行中的结果，之后直接命中缓存"""
+    async def run():
+        backend = LocalGuessBackend()
+        service = GuesserService(backend, batch_wait=0.02)
+        try:
+            image = drawing(0)
+            first, second = await asyncio.gather(service.guess("a", image), service.guess("b", image))
+            assert first == second
+            assert backend.calls == 1
+            assert await service.guess("c", image) == first
+            assert backend.calls == 1
+            assert service.cache_hits == 1
+            # 提示词不同视为不同的请求
+            await service.guess("c", image, "水果")
+            assert backend.calls == 2
+            blank = cv2.imencode(".jpg", np.full((120, 160, 3), 255, dtype=np.uint8))[1].tobytes()
+            assert await service.guess("c", blank) == "空白"
+        finally:
+            service.close()
+    asyncio.run(run())
+
+def test_guesser_cache_eviction_and_failures():
+    """缓存按最近使用淘汰，失败的结果不缓存"""
+    class FailingBackend(LocalGuessBackend):
+        fail = True
+
+        async def guess_batch(self, images, hints):
+            if self.fail:
+                self.calls += 1
+                raise RuntimeError("unavailable")
+            return await super().guess_batch(images, hints)
+
+    async def run():
+        backend = FailingBackend()
+        service = GuesserService(backend, batch_wait=0, cache_size=2)
+        try:
+            assert await service.guess("a", drawing(0)) == "猜测失败，请重试"
+            assert not service.cache
+            backend.fail = False
+            for i in range(3):
+                await service.guess("a", drawing(i))
+            assert len(service.cache) == 2
+            assert service.cache_key(drawing(0)) not in service.cache
+            assert not service.inflight
+        finally:
+            service.close()
+    asyncio.run(run())
+
+def test_guesser_short_answer_list():
+    """结果数与图片数不一致时按失败处理，所有请求都得到结果，房间之后仍能请求"""
+    class ShortBackend(LocalGuessBackend):
+        async def guess_batch(self, images, hints):
+            self.calls += 1
+            return ["x"]
+
+    async def run():
+        service = GuesserService(ShortBackend(), batch_wait=0.02, room_concurrency=1)
+        try:
+            answers = await asyncio.wait_for(asyncio.gather(
+                service.guess("a", drawing(0)), service.guess("b", drawing(1))
+            ), 1)
+            assert answers == ["猜测失败，请重试"] * 2
+            assert not service.cache and not service.inflight and not service.room_slots
+            assert await asyncio.wait_for(service.guess("a", drawing(2)), 1) == "x"
+        finally:
+            service.close()
+    asyncio.run(run())
+
+def test_rdp_edge_cases():
+    assert rdp([], 1.0) == []
+    assert rdp([(0, 0), (5, 5)], 1.0) == [(0, 0), (5, 5)]
+    # 共线的点只保留首尾，偏差超过容差的点保留
+    assert rdp([(0, 0), (5, 0.5), (10, 0)], 1.0) == [(0, 0), (10, 0)]
+    assert rdp([(0, 0), (5, 3), (10, 0)], 1.0) == [(0, 0), (5, 3), (10, 0)]
+    # 首尾重合时按到端点的距离判断
+    assert rdp([(0, 0), (3, 4), (0, 0)], 1.0) == [(0, 0), (3, 4), (0, 0)]
+
+def test_simplifier_passthrough_and_pen_up():
+    """容差为0时原样输出；抬笔时补上因距离太近暂缓的最后一个点，重复的抬笔被丢弃"""
+    assert StrokeSimplifier(0).push((1, 1, False, None)) == [(1, 1, False, None)]
+    simplifier = StrokeSimplifier(1.0, window=4)
+    assert simplifier.push((0, 0, True, (0, 0, 255))) == [(0, 0, True, (0, 0, 255))]
+    assert simplifier.push((0.5, 0, True, None)) == []
+    assert simplifier.push((10, 0, True, None)) == []
+    assert simplifier.push((20, 0, True, None)) == []
+    # 窗口攒满后简化输出，共线的中间点被去掉
+    assert simplifier.push((30, 0, True, None)) == [(30, 0, True, None)]
+    assert simplifier.push((30.4, 0, True, None)) == []
+    assert simplifier.push((30.4, 0, False, None)) == [(30.4, 0, True, None), (30.4, 0, False, None)]
+    assert simplifier.push((30.4, 0, False, None)) == []
+
+def test_simplifier_colors_and_reset():
+    """颜色不变时不重复发送颜色，颜色变化时先输出之前的点；重置后丢弃缓存的点"""
+    simplifier = StrokeSimplifier(1.0)
+    simplifier.push((0, 0, True, (0, 0, 255)))
+    simplifier.push((10, 0, True, None))
+    assert simplifier.push((10, 5, True, (0, 0, 255))) == []
+    assert simplifier.push((20, 5, True, (255, 0, 0))) == [
+        (10, 0, True, None), (10, 5, True, None), (20, 5, True, (255, 0, 0))
+    ]
+    simplifier.push((30, 5, True, None))
+    simplifier.reset()
+    assert simplifier.drain() == []
+    # 重置后的第一个点是新笔画的起点
+    assert simplifier.push((40, 40, True, None)) == [(40, 40, True, None)]
+
+def test_room_reset_discards_buffered_points():
+    """重置游戏后，上一局缓存在简化器中的点不会画到新的画布上"""
+    room = Room("reset", InProcessBackplane(), simplify_tolerance=1.0)
+    room.draw_batch([(0, 0, True, None), (10, 0, True, None), (20, 0, True, None)])
+    room.reset_game("猫")
+    assert room.simplifier.drain() == []
+    assert room.game_state.current_word == "猫"
+    assert room.game_state.canvas.min() == 255
+
+def test_token_bucket():
+    bucket = TokenBucket(2, 4, now=0)
+    assert all(bucket.take(now=0) for _ in range(4))
+    assert not bucket.take(now=0)
+    # 补充的令牌不超过容量
+    assert bucket.take_up_to(10, now=100) == 4
+    assert bucket.take_up_to(3, now=100.75) == 1
+    assert not bucket.take(now=100.75)
+    assert bucket.take(now=101.5)
+
+def test_coalesce_points():
+    """只保留抬笔、换色和一批中的最后一个点"""
+    points = [(i, 0, True, None) for i in range(5)]
+    assert coalesce_points(points) == [(4, 0, True, None)]
+    assert coalesce_points(points[:1]) == []
+    points[1] = (1, 0, False, None)
+    points[2] = (2, 0, True, (0, 0, 255))
+    assert coalesce_points(points) == [(1, 0, False, None), (2, 0, True, (0, 0, 255)), (4, 0, True, None)]
+    pen_ups = [(i, 0, False, None) for i in range(20)]
+    assert coalesce_points(pen_ups, max_points=3) == pen_ups[-3:]
+
+def test_rate_limiter_roles():
+    """角色的限额覆盖默认值，未列出的类型不限制，切换角色后已消耗的令牌不会恢复"""
+    limits = {"*": {"guess": (0.001, 3)}, "guesser": {"guess": (0.001, 1)}}
+    limiter = RateLimiter(limits=limits)
+    assert limiter.allow("guess")
+    limiter.set_role("guesser")
+    # 剩余的令牌按新角色的容量截断
+    assert limiter.allow("guess")
+    assert not limiter.allow("guess")
+    assert all(limiter.allow("pong") for _ in range(100))
+    limiter.set_role("drawer")
+    assert limiter.bucket("guess").burst == 3
+    assert not limiter.allow("guess")
+
+def test_rate_limiter_points():
+    """超出限额的绘制点合并为关键点"""
+    limiter = RateLimiter(limits={"*": {"draw": (0.001, 3)}})
+    points = [(i, 0, True, None) for i in range(6)] + [(6, 0, False, None)]
+    assert limiter.limit_points(points[:2]) == points[:2]
+    assert limiter.limit_points(points) == [points[0], points[6]]
+    assert limiter.limit_points(points[:3]) == [points[2]]
+    assert RateLimiter(limits={}).limit_points(points) == points
+
+def test_rate_limiter_flood(monkeypatch):
+    """持续超出总消息限额时才断开，偶尔放行的消息不会清零计数"""
+    monkeypatch.setattr(tyf_ratelimit, "FLOOD_DISCONNECT_DROPS", 3)
+    limiter = RateLimiter(limits={}, message_rate=0.001, message_burst=2)
+    assert limiter.admit() and limiter.admit()
+    assert not limiter.admit() and not limiter.flooded
+    limiter.messages.tokens = 1
+    assert limiter.admit()
+    assert limiter.flooding == 1
+    assert not limiter.admit() and not limiter.admit()
+    assert limiter.flooded
+    # 令牌攒回一半以上后计数清零
+    limiter.messages.tokens = 2
+    assert limiter.admit() and not limiter.flooded
+    # 设置为0时从不断开
+    monkeypatch.setattr(tyf_ratelimit, "FLOOD_DISCONNECT_DROPS", 0)
+    limiter.flooding = 1000
+    assert not limiter.flooded
+
+def test_normalize():
+    """全角、大小写、空白标点、声调和繁体都不影响匹配"""
+    assert normalize(" 籃球！") == "篮球"
+    assert normalize("ＬáｎＱｉú") == "lanqiu"
+    assert normalize("Apple Pie") == "applepie"
+    assert normalize("？？ ") == ""
+    assert normalize("猫" * 100) == "猫" * tyf_match.GUESS_MAX_LENGTH
+
+def test_matcher_edge_cases():
+    matcher = GuessMatcher(["篮球", "乒乓球", "猫"], {"篮球": ["lanqiu"], "乒乓球": ["乒乓"]})
+    assert matcher.match("籃 球", "篮球") == CORRECT
+    assert matcher.match("LAN QIU", "篮球") == CORRECT
+    assert matcher.match("乒乓", "乒乓球") == CORRECT
+    # 至少两个字的片段，或包含了词语，算作接近
+    assert matcher.match("乓球", "乒乓球") == CLOSE
+    assert matcher.match("打篮球", "篮球") == CLOSE
+    assert matcher.match("猫咪", "猫") == CLOSE
+    # 单个字、字母别名的一部分或包含字母别名的猜测都不算接近
+    assert matcher.match("篮", "篮球") == WRONG
+    assert matcher.match("lan", "篮球") == WRONG
+    assert matcher.match("lanqiuchang", "篮球") == WRONG
+    assert matcher.match("", "猫") == WRONG
+    assert matcher.match("！！", "猫") == WRONG
+    # 其他词语的别名不算当前词语的正确答案
+    assert matcher.match("lanqiu", "乒乓球") == WRONG
+    # 不在词库中的词只按词语本身判断
+    assert matcher.match("狗", "狗") == CORRECT
+    assert matcher.match("小狗", "狗") == CLOSE
+    assert matcher.match("猫", "狗") == WRONG
+
+@pytest.mark.skipif(not tyf_match.PINYIN_AVAILABLE, reason="需要pypinyin")
+def test_matcher_homophones():
+    matcher = GuessMatcher(["篮球"])
+    assert matcher.match("lanqiu", "篮球") == CORRECT
+    assert matcher.match("兰球", "篮球") == CLOSE
+
+def test_bundled_word_bank_pinyin():
+    """内置词库带有拼音别名，未安装pypinyin时也能用拼音猜中"""
+    bank = default_word_bank()
+    matcher = matcher_for(bank)
+    assert matcher_for(bank) is matcher
+    assert matcher.match("lanqiu", "篮球") == CORRECT
+    assert matcher.match("pingpangqiu", "乒乓球") == CORRECT
+
+def stroke(game_state, x):
+    """画一条短横线，返回取出画布消息的协程"""
+    game_state.update_canvas_batch([(x, 100, True, None), (x + 5, 100, True, None), (x + 5, 100, False, None)])
+    return game_state.take_canvas_update()
+
+def test_catch_up_resume_gets_only_deltas():
+    """重连时last_seq之后的增量都还在记录中，只补发合并后的增量"""
+    async def run():
+        game_state = GameState()
+        messages = [await stroke(game_state, x) for x in (10, 20, 30)]
+        assert [message["type"] for message in messages] == ["stroke"] * 3
+        caught_up = game_state.catch_up(messages[0]["seq"])
+        assert caught_up == [{
+            "type": "stroke",
+            "segments": messages[1]["segments"] + messages[2]["segments"],
+            "seq": messages[2]["seq"]
+        }]
+        assert game_state.catch_up(messages[2]["seq"]) == []
+        # 新加入的客户端收到关键帧和之后的全部增量
+        full = game_state.catch_up()
+        assert full[0]["type"] == "canvas_update" and full[0]["seq"] == game_state.keyframe_seq
+        assert full[1]["seq"] == messages[2]["seq"] and len(full) == 2
+    asyncio.run(run())
+
+def test_catch_up_before_keyframe_gets_keyframe():
+    """last_seq早于关键帧，或来自重启之前（大于当前序号）时补发完整画面"""
+    async def run():
+        game_state = GameState()
+        first = await stroke(game_state, 10)
+        # 清空画布后的下一条消息是完整画面
+        game_state.clear_canvas()
+        keyframe = await stroke(game_state, 20)
+        assert keyframe["type"] == "canvas_update"
+        assert game_state.keyframe_seq == keyframe["seq"] > first["seq"]
+        for last_seq in (first["seq"], game_state.seq + 100):
+            caught_up = game_state.catch_up(last_seq)
+            assert caught_up == [{"type": "canvas_update", "seq": keyframe["seq"], "image": keyframe["image"]}]
+    asyncio.run(run())
+
+def test_delta_log_rolls_over_to_keyframe(monkeypatch):
+    """增量记录满了以后以当前画面生成新的关键帧，补发的消息数有上限"""
+    monkeypatch.setattr(tyf_multiplayer, "DELTA_LOG_SIZE", 3)
+    async def run():
+        game_state = GameState()
+        messages = [await stroke(game_state, x) for x in (10, 20, 30, 40)]
+        assert [message["type"] for message in messages] == ["stroke"] * 4
+        assert game_state.keyframe_seq == messages[3]["seq"]
+        assert not game_state.delta_log
+        caught_up = game_state.catch_up(messages[0]["seq"])
+        assert [message["type"] for message in caught_up] == ["canvas_update"]
+        # 新的关键帧包含之前所有的线段
+        image = cv2.imdecode(np.frombuffer(caught_up[0]["image"], dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        assert image[100, 12] < 128 and image[100, 42] < 128
+    asyncio.run(run())
+
+def test_catch_up_after_reset_starts_from_blank():
+    """重置后从空白关键帧开始，旧一局的增量不再补发"""
+    async def run():
+        game_state = GameState()
+        before = await stroke(game_state, 10)
+        game_state.reset_game("猫")
+        for last_seq in (None, before["seq"]):
+            caught_up = game_state.catch_up(last_seq)
+            assert len(caught_up) == 1
+            assert caught_up[0]["seq"] == game_state.seq
+            image = cv2.imdecode(np.frombuffer(caught_up[0]["image"], dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+            assert image.min() > 200
+        # 重置之后的第一笔照常作为增量补发
+        after = await stroke(game_state, 20)
+        assert game_state.catch_up(game_state.keyframe_seq) == [after]
+    asyncio.run(run())
+
+def test_merge_strokes_keeps_order():
+    """只合并相邻的线段增量"""
+    messages = [
+        {"type": "stroke", "segments": [1], "seq": 1},
+        {"type": "stroke", "segments": [2], "seq": 2},
+        {"type": "canvas_tiles", "tiles": [], "seq": 3},
+        {"type": "stroke", "segments": [3], "seq": 4}
+    ]
+    assert merge_strokes(messages) == [
+        {"type": "stroke", "segments": [1, 2], "seq": 2},
+        {"type": "canvas_tiles", "tiles": [], "seq": 3},
+        {"type": "stroke", "segments": [3], "seq": 4}
+    ]
+    assert merge_strokes([]) == []
+    # 合并不修改原来的消息
+    assert messages[0]["segments"] == [1]
+
+def test_resume_session(monkeypatch):
+    """令牌有效且角色一致时恢复会话，超过上限时淘汰最久未使用的会话"""
+    monkeypatch.setattr(tyf_multiplayer, "MAX_SESSIONS_PER_ROOM", 2)
+    room = Room("sessions", InProcessBackplane())
+    drawer = room.create_session("drawer")
+    guesser = room.create_session("guesser")
+    assert room.resume_session(drawer, "drawer")
+    assert not room.resume_session(drawer, "guesser")
+    assert not room.resume_session(None, "drawer")
+    assert not room.resume_session("unknown", "drawer")
+    # drawer刚刚使用过，淘汰的是guesser
+    room.create_session("guesser")
+    assert room.resume_session(drawer, "drawer")
+    assert not room.resume_session(guesser, "guesser")
+
+class FakeWebSocket:
+    """只记录关闭代码的WebSocket替身"""
+    def __init__(self):
+        self.close_code = None
+        self.sent = []
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+    async def send_text(self, data):
+        self.sent.append(data)
+
+def queued_types(connection):
+    return [frame.type for frame in connection.queue]
+
+def test_send_queue_drops_oldest_canvas_frame():
+    """队列满时丢弃最旧的画布消息并标记需要补发，其他消息保留"""
+    async def run():
+        connection = ClientConnection(FakeWebSocket(), max_queue=3)
+        connection.send({"type": "stroke", "segments": [], "seq": 1})
+        connection.send({"type": "guess_result", "guess": "猫"})
+        connection.send({"type": "stroke", "segments": [], "seq": 2})
+        connection.send({"type": "game_reset", "current_word": "狗"})
+        assert queued_types(connection) == ["guess_result", "stroke", "game_reset"]
+        assert connection.dropped == 1 and connection.canvas_stale
+        # 完整画面替换队列中所有旧的画布消息
+        connection.send({"type": "canvas_update", "image": b"", "seq": 3})
+        assert queued_types(connection) == ["guess_result", "game_reset", "canvas_update"]
+        assert not connection.canvas_stale and not connection.closed
+    asyncio.run(run())
+
+def test_send_queue_overflow_with_control_frames():
+    """队列中全是其他消息时，新的画布消息被丢弃，新的其他消息使连接断开"""
+    async def run():
+        websocket = FakeWebSocket()
+        connection = ClientConnection(websocket, max_queue=2)
+        connection.send({"type": "guess_result", "guess": "猫"})
+        connection.send({"type": "guess_result", "guess": "狗"})
+        connection.send({"type": "stroke", "segments": [], "seq": 1})
+        assert queued_types(connection) == ["guess_result", "guess_result"]
+        assert connection.canvas_stale and not connection.closed
+        connection.send({"type": "game_reset", "current_word": "猫"})
+        assert connection.closed and not connection.queue
+        await wait_for(lambda: websocket.close_code == 1011)
+        # 关闭后不再接受消息
+        connection.send({"type": "game_reset", "current_word": "猫"})
+        assert not connection.queue
+    asyncio.run(run())
+
+def test_stale_guesser_gets_catch_up():
+    """丢失过画布消息的猜词者在下个周期收到关键帧，其他猜词者不受影响"""
+    async def run():
+        room = Room("stale", InProcessBackplane(), simplify_tolerance=0)
+        connections = []
+        for _ in range(2):
+            websocket = FakeWebSocket()
+            connection = room.manager.active_connections[websocket] = ClientConnection(websocket, max_queue=4)
+            room.manager.add_guesser(websocket)
+            connections.append(connection)
+        stale, fresh = connections
+        stale.canvas_stale = True
+        await room.tick()
+        assert queued_types(stale) == ["canvas_update"]
+        assert not stale.canvas_stale
+        assert not fresh.queue
+        assert room.manager.stale_guessers() == []
+    asyncio.run(run())
+
+def write_word_files(directory):
+    (directory / "动物.txt").write_text("猫\n狗\t2\n# 注释\n\n大象\t3\t=elephant\n", encoding="utf-8")
+    (directory / "食物.txt").write_text("苹果\t=pingguo\n猫\n香蕉\t2\n", encoding="utf-8")
+
+def test_word_bank_cache_round_trip(tmp_path, monkeypatch):
+    """第二次加载直接读取编译缓存，内容与编译结果一致；源文件修改后重新编译"""
+    write_word_files(tmp_path)
+    bank = load_word_bank(str(tmp_path))
+    assert sorted(bank.words()) == sorted(["猫", "狗", "大象", "苹果", "香蕉"])
+    assert bank.aliases[bank.words().index("大象")] == ["elephant"]
+    assert [bank.word(i) for i in bank.indices("动物", 3)] == ["大象"]
+    assert (tmp_path / ".wordbank.npz").exists()
+
+    # 编译函数不应再被调用
+    monkeypatch.setattr(WordBank, "compile", None)
+    cached = load_word_bank(str(tmp_path))
+    assert cached.words() == bank.words()
+    assert cached.categories == bank.categories
+    assert cached.groups == bank.groups
+    assert cached.aliases == bank.aliases
+    assert cached.spellings == bank.spellings
+    monkeypatch.undo()
+
+    (tmp_path / "食物.txt").write_text("西瓜\n", encoding="utf-8")
+    assert "西瓜" in load_word_bank(str(tmp_path)).words()
+    # 缓存损坏时重新编译
+    (tmp_path / ".wordbank.npz").write_bytes(b"broken")
+    assert "西瓜" in load_word_bank(str(tmp_path)).words()
+    assert cache_path_for(str(tmp_path / "食物.txt")) == str(tmp_path / "食物.txt") + ".npz"
+
+def test_word_deck_does_not_repeat(tmp_path):
+    """一副牌发完之前不重复，重新洗牌后第一张不是上一副的最后一张"""
+    write_word_files(tmp_path)
+    bank = load_word_bank(str(tmp_path))
+    for seed in range(20):
+        deck = WordDeck(bank, rng=np.random.default_rng(seed))
+        first = [deck.draw() for _ in range(len(deck))]
+        assert sorted(first) == sorted(bank.words())
+        second = deck.draw()
+        assert second != first[-1]
+    animals = WordDeck(bank, category="动物")
+    assert sorted(animals.draw() for _ in range(len(animals))) == sorted(["猫", "狗", "大象"])
+    # 没有符合条件的词时使用整个词库
+    assert len(WordDeck(bank, category="不存在")) == len(bank)
+
+def test_canvas_etag(monkeypatch):
+    """画面没有变化时返回304，画布修改、换格式或尺寸、房间重新创建后ETag都不同"""
+    room = Room("etag", InProcessBackplane())
+    monkeypatch.setitem(tyf_multiplayer.rooms.rooms, "etag", room)
+    with TestClient(tyf_multiplayer.app) as client:
+        response = client.get("/canvas?room=etag")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/jpeg"
+        etag = response.headers["etag"]
+        for header in (etag, "W/" + etag, '"other", ' + etag, "*"):
+            cached = client.get("/canvas?room=etag", headers={"If-None-Match": header})
+            assert cached.status_code == 304 and cached.content == b""
+            assert cached.headers["etag"] == etag
+        assert client.get("/canvas?room=etag", headers={"If-None-Match": '"other"'}).status_code == 200
+
+        room.game_state.update_canvas_batch([(10, 10, True, None), (50, 50, True, None)])
+        changed = client.get("/canvas?room=etag", headers={"If-None-Match": etag})
+        assert changed.status_code == 200 and changed.headers["etag"] != etag
+
+        png = client.get("/canvas?room=etag&format=png")
+        assert png.headers["content-type"] == "image/png"
+        assert png.headers["etag"] not in (etag, changed.headers["etag"])
+        # 缩略图宽度限制在范围内并按16取整，宽度也是ETag的一部分
+        thumbnail = client.get("/canvas/thumbnail?room=etag&width=1000")
+        assert thumbnail.headers["etag"].endswith('-640"')
+        image = cv2.imdecode(np.frombuffer(thumbnail.content, dtype=np.uint8), cv2.IMREAD_COLOR)
+        assert image.shape[1] == 640
+        assert client.get("/canvas/thumbnail?room=etag&width=100").headers["etag"].endswith('-96"')
+
+        assert client.get("/canvas?room=missing").status_code == 404
+        assert client.get("/canvas?room=etag&format=gif").status_code == 404
+        # 房间重新创建后版本号从头开始，ETag仍然不同
+        recreated = Room("etag", InProcessBackplane())
+        recreated.game_state.version = room.game_state.version
+        monkeypatch.setitem(tyf_multiplayer.rooms.rooms, "etag", recreated)
+        assert client.get("/canvas?room=etag", headers={"If-None-Match": changed.headers["etag"]}).status_code == 200
+
+def segment(x0, y0, x1, y1, color=(0, 0, 255)):
+    return {"from": [x0, y0], "to": [x1, y1], "color": list(color), "thickness": 3}
+
+def test_stroke_log_round_trip(tmp_path):
+    """写入的记录在进程崩溃后恢复，回放得到相同的画面；下一局开始时上一局改名为已结束"""
+    log = StrokeLog("room", str(tmp_path))
+    log.start_round("猫")
+    log.segment(segment(10, 10, 100, 10))
+    log.clear()
+    log.segment(segment(10, 50, 100, 50))
+    background = np.full((480, 640, 3), 255, dtype=np.uint8)
+    cv2.circle(background, (300, 300), 40, (255, 0, 0), -1)
+    log.image(cv2.imencode(".png", background)[1].tobytes())
+    log.segment(segment(10, 90, 100, 90, (0, 255, 0)))
+    assert log.write_batch(log.take_batch()) == []
+
+    expected = BGRCanvas()
+    expected.draw_line((10, 50), (100, 50), (0, 0, 255), 3)
+    expected.load_bgr(background)
+    expected.draw_line((10, 90), (100, 90), (0, 255, 0), 3)
+
+    recovered = StrokeLog("room", str(tmp_path))
+    path = recovered.recover()
+    assert path == log.path and recovered.images == 1
+    board = BGRCanvas()
+    assert replay(path, board) == "猫"
+    assert np.array_equal(board.to_bgr(), expected.to_bgr())
+
+    recovered.start_round("狗")
+    finished = recovered.write_batch(recovered.take_batch())
+    assert finished == [path[:-len(".part")]]
+    assert read_log(finished[0])[0] == "猫"
+    word, records = read_log(recovered.path)
+    assert word == "狗" and len(records) == 0
+
+def test_stroke_log_ignores_torn_record(tmp_path):
+    """崩溃时写了一半的最后一条记录被忽略"""
+    log = StrokeLog("room", str(tmp_path))
+    log.start_round("猫")
+    log.segment(segment(10, 10, 100, 10))
+    log.segment(segment(10, 50, 100, 50))
+    log.write_batch(log.take_batch())
+    with open(log.path, "ab") as f:
+        f.write(b"\x01\x02\x03\x04\x05")
+    word, records = read_log(log.path)
+    assert word == "猫" and len(records) == 2
+    assert records.dtype == RECORD_DTYPE
+    assert [int(record["y0"]) for record in records] == [10, 50]
+    board = BGRCanvas()
+    replay(log.path, board)
+    assert board.to_bgr()[50, 50].tolist() == [0, 0, 255]
+
+def test_stroke_log_nodes_do_not_share_files(tmp_path):
+    """多个节点各自写入和恢复自己的文件，不会接管或结束其他节点进行中的一局"""
+    first = StrokeLog("room", str(tmp_path), node="a")
+    first.start_round("猫")
+    first.segment(segment(10, 10, 100, 10))
+    first.write_batch(first.take_batch())
+
+    second = StrokeLog("room", str(tmp_path), node="b")
+    assert second.recover() is None
+    second.start_round("猫")
+    second.finish_round()
+    second.start_round("狗")
+    second.write_batch(second.take_batch())
+    assert second.path != first.path
+
+    # 第一个节点的文件仍在原处，继续写入后仍然可以读取
+    first.segment(segment(10, 50, 100, 50))
+    first.write_batch(first.take_batch())
+    word, records = read_log(first.path)
+    assert word == "猫" and len(records) == 2
+    # 重启后的节点只恢复自己的文件
+    assert StrokeLog("room", str(tmp_path), node="a").recover() == first.path
+    assert StrokeLog("room", str(tmp_path), node="b").recover() == second.path
+
+def test_remote_operations_are_not_logged(tmp_path):
+    """其他工作进程的线段和清空由它自己记录，本节点只记录本地产生的操作"""
+    async def run():
+        room = Room("logged", InProcessBackplane(), simplify_tolerance=0)
+        log = room.game_state.stroke_log = StrokeLog("logged", str(tmp_path), node="a")
+        log.start_round(room.game_state.current_word)
+        header = len(log.pending)
+        await room.handle_remote_event({"op": "segments", "segments": [segment(10, 10, 100, 10)]})
+        await room.handle_remote_event({"op": "clear"})
+        assert len(log.pending) == header
+        room.draw_batch([(10, 50, True, None), (100, 50, True, None)])
+        room.game_state.clear_canvas()
+        assert len(log.pending) == header + 2 * RECORD_DTYPE.itemsize
+    asyncio.run(run())
@@ -0,0 +1,233 @@
+import asyncio
+import json
+import os
+import sys
+import uuid
+from urllib.parse import urlparse
+
+# 跨进程消息总线：同一房间分布在多个工作进程时，用它同步游戏事件
+# 连接分配到哪个工作进程由前端代理或uvicorn决定，不要求同一房间固定在一个进程
+# BACKPLANE_URL 未设置时使用进程内实现，例如：
+#   tcp://127.0.0.1:7700
+#   unix:///tmp/tyf_backplane.sock
+
+# 第一次启动时等待连接消息代理的最长时间（秒），超时后先只在本进程内运行，后台继续重连
+BACKPLANE_CONNECT_TIMEOUT = float(os.environ.get("BACKPLANE_CONNECT_TIMEOUT", 1.0))
+
+# 本节点写入文件（例如笔画日志）时使用的名称，只能包含字母和数字，每个工作进程需要不同的值；
+# 固定的名称让工作进程重启后可以恢复自己进行中的一局。
+# 未设置时进程内总线不使用名称（只有一个进程），连接消息代理的节点使用随机生成的节点标识
+BACKPLANE_NODE_NAME = os.environ.get("BACKPLANE_NODE_NAME", "")
+
+class Backplane:
+    """消息总线接口，按房间号发布和订阅游戏事件，不会收到自己发布的事件"""
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex[:8]
+        self.node_name = BACKPLANE_NODE_NAME
+        self.handlers = {}  # 房间号 -> 异步回调
+
+    async def start(self):
+        """连接消息总线，可重复调用"""
+
+    async def close(self):
+        """断开消息总线"""
+
+    def subscribe(self, room_id, handler):
+        """订阅房间事件，handler为接收事件字典的协程函数"""
+        self.handlers[room_id] = handler
+
+    def unsubscribe(self, room_id):
+        """取消订阅房间事件"""
+        self.handlers.pop(room_id, None)
+
+    async def publish(self, room_id, event: dict):
+        """向订阅了该房间的其他节点发布事件"""
+        raise NotImplementedError
+
+    async def deliver(self, room_id, event: dict):
+        """把收到的事件交给本节点的房间处理"""
+        handler = self.handlers.get(room_id)
+        if handler is None:
+            return
+        try:
+            await handler(event)
+        except Exception as e:
+            print(f"处理消息总线事件失败: {e}")
+
+class InProcessBackplane(Backplane):
+    """进程内消息总线，共享同一个hub的节点之间互相投递事件"""
+    def __init__(self, hub=None):
+        super().__init__()
+        # hub: 房间号 -> 订阅该房间的节点列表
+        self.hub = hub if hub is not None else {}
+
+    def subscribe(self, room_id, handler):
+        super().subscribe(room_id, handler)
+        nodes = self.hub.setdefault(room_id, [])
+        if self not in nodes:
+            nodes.append(self)
+
+    def unsubscribe(self, room_id):
+        super().unsubscribe(room_id)
+        nodes = self.hub.get(room_id)
+        if nodes and self in nodes:
+            nodes.remove(self)
+            if not nodes:
+                del self.hub[room_id]
+
+    async def publish(self, room_id, event: dict):
+        for node in self.hub.get(room_id, ()):
+            if node is not self:
+                await node.deliver(room_id, event)
+
+class SocketBackplane(Backplane):
+    """通过TCP或Unix套接字连接到BackplaneBroker的消息总线，每行一个JSON帧"""
+    def __init__(self, url):
+        super().__init__()
+        # 其他工作进程也在写同一目录，文件名必须区分节点
+        self.node_name = BACKPLANE_NODE_NAME or self.node_id
+        self.url = url
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+        self.connected = asyncio.Event()
+        self.reconnect_delay = 1.0
+
+    async def start(self):
+        if self.reader_task is not None:
+            return
+        self.reader_task = asyncio.create_task(self.run())
+        # 消息代理不可用时不能让新连接一直等待
+        try:
+            await asyncio.wait_for(self.connected.wait(), BACKPLANE_CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"暂时无法连接消息总线，先只在本进程内同步: {self.url}")
+
+    async def close(self):
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            self.reader_task = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.connected.clear()
+
+    async def run(self):
+        """维持与消息代理的连接，断开后自动重连并重新订阅"""
+        while True:
+            try:
+                self.reader, self.writer = await open_url(self.url)
+                for room_id in self.handlers:
+                    self.send_frame({"op": "sub", "room": room_id})
+                self.connected.set()
+                print(f"已连接到消息总线: {self.url}")
+                while True:
+                    line = await self.reader.readline()
+                    if not line:
+                        break
+                    frame = json.loads(line)
+                    await self.deliver(frame["room"], frame["event"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"消息总线连接失败: {e}")
+            self.connected.clear()
+            self.writer = None
+            await asyncio.sleep(self.reconnect_delay)
+
+    def send_frame(self, frame: dict):
+        if self.writer is not None:
+            self.writer.write(json.dumps(frame, ensure_ascii=False, separators=(",", ":")).encode('utf-8') + b"\n")
+
+    def subscribe(self, room_id, handler):
+        super().subscribe(room_id, handler)
+        self.send_frame({"op": "sub", "room": room_id})
+
+    def unsubscribe(self, room_id):
+        super().unsubscribe(room_id)
+        self.send_frame({"op": "unsub", "room": room_id})
+
+    async def publish(self, room_id, event: dict):
+        if self.writer is None:
+            return
+        self.send_frame({"op": "pub", "room": room_id, "event": event})
+        await self.writer.drain()
+
+class BackplaneBroker:
+    """SocketBackplane使用的消息代理，把事件转发给订阅了同一房间的其他连接"""
+    def __init__(self):
+        self.subscribers = {}  # 房间号 -> 订阅该房间的writer集合
+        self.server = None
+
+    async def start(self, url):
+        parsed = urlparse(url)
+        if parsed.scheme == "unix":
+            self.server = await asyncio.start_unix_server(self.handle_client, path=parsed.path)
+        else:
+            self.server = await asyncio.start_server(self.handle_client, parsed.hostname, parsed.port)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle_client(self, reader, writer):
+        rooms = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                frame = json.loads(line)
+                room_id = frame["room"]
+                if frame["op"] == "sub":
+                    rooms.add(room_id)
+                    self.subscribers.setdefault(room_id, set()).add(writer)
+                elif frame["op"] == "unsub":
+                    rooms.discard(room_id)
+                    self.remove_subscriber(room_id, writer)
+                elif frame["op"] == "pub":
+                    data = json.dumps({"room": room_id, "event": frame["event"]}, ensure_ascii=False, separators=(",", ":")).encode('utf-8') + b"\n"
+                    for subscriber in self.subscribers.get(room_id, ()):
+                        if subscriber is not writer:
+                            subscriber.write(data)
+        except (ConnectionError, ValueError) as e:
+            print(f"消息代理连接异常: {e}")
+        finally:
+            for room_id in rooms:
+                self.remove_subscriber(room_id, writer)
+            writer.close()
+
+    def remove_subscriber(self, room_id, writer):
+        subscribers = self.subscribers.get(room_id)
+        if subscribers is not None:
+            subscribers.discard(writer)
+            if not subscribers:
+                del self.subscribers[room_id]
+
+async def open_url(url):
+    """按地址打开TCP或Unix套接字连接"""
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        return await asyncio.open_unix_connection(parsed.path)
+    return await asyncio.open_connection(parsed.hostname, parsed.port)
+
+def create_backplane(url=None):
+    """根据地址创建消息总线，未指定地址时使用进程内实现"""
+    if not url:
+        return InProcessBackplane()
+    return SocketBackplane(url)
+
+async def run_broker(url):
+    broker = BackplaneBroker()
+    server = await broker.start(url)
+    print(f"消息代理已启动: {url}")
+    async with server:
+        await server.serve_forever()
+
+# 启动消息代理
+if __name__ == "__main__":
+    url = sys.argv[1] if len(sys.argv) > 1 else os.environ.get("BACKPLANE_URL", "tcp://127.0.0.1:7700")
+    asyncio.run(run_broker(url))
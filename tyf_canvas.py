@@ -0,0 +1,185 @@
+import io
+
+import cv2
+import numpy as np
+
+# 画布存储：BGRCanvas为3通道BGR数组；PaletteCanvas每个像素只存1字节调色板下标，
+# 只在编码时展开为BGR，内存约为前者的三分之一
+# 编码在线程池中进行，因此先用snapshot()在事件循环中复制数据，再在线程中调用encode()
+# 载入整幅图片同理：quantizer()在事件循环中取得，在线程中转换，再用load_quantized()替换画布
+
+# 默认调色板：白色背景加上手势客户端的5种颜色（BGR格式）
+DEFAULT_PALETTE = [
+    (255, 255, 255),  # 白色（背景）
+    (0, 0, 0),        # 黑色
+    (0, 0, 255),      # 红色
+    (0, 255, 0),      # 绿色
+    (255, 0, 0),      # 蓝色
+    (0, 255, 255)     # 黄色
+]
+# 量化图片时每次计算最近颜色的颜色数，限制临时数组的大小
+QUANTIZE_CHUNK = 4096
+
+class BGRCanvas:
+    """3通道BGR画布"""
+    def __init__(self, height=480, width=640):
+        self.height = height
+        self.width = width
+        self.pixels = np.full((height, width, 3), 255, dtype=np.uint8)
+
+    def draw_line(self, start, end, color, thickness):
+        cv2.line(self.pixels, start, end, color, thickness)
+
+    def clear(self):
+        self.pixels.fill(255)
+
+    def to_bgr(self):
+        """返回BGR数组（即内部数组，不复制）"""
+        return self.pixels
+
+    def quantizer(self):
+        """返回把BGR图片转换为画布数据的函数，可以在线程池中调用"""
+        height, width = self.height, self.width
+        return lambda image: np.ascontiguousarray(image[:height, :width], dtype=np.uint8)
+
+    def load_quantized(self, pixels):
+        self.pixels = pixels
+
+    def load_bgr(self, image):
+        self.load_quantized(self.quantizer()(image))
+
+    def snapshot(self, x=0, y=0, width=None, height=None):
+        """复制画布（或其中一块区域）供线程池编码"""
+        return self.pixels[y:y + (height or self.height), x:x + (width or self.width)].copy()
+
+    @staticmethod
+    def render(snapshot):
+        return snapshot
+
+    @staticmethod
+    def encode(snapshot, ext=".jpg"):
+        """在线程池中编码快照"""
+        return cv2.imencode(ext, snapshot)[1].tobytes()
+
+class PaletteCanvas:
+    """调色板下标画布，每个像素1字节，最多256种颜色"""
+    def __init__(self, height=480, width=640, palette=DEFAULT_PALETTE):
+        self.height = height
+        self.width = width
+        self.palette = np.zeros((256, 3), dtype=np.uint8)
+        self.size = 0  # 调色板中已使用的颜色数
+        self.color_indices = {}  # BGR元组 -> 调色板下标，只包含调色板中的颜色
+        for color in palette:
+            self.color_index(color)
+        self.indices = np.zeros((height, width), dtype=np.uint8)  # 0为白色背景
+
+    def color_index(self, color):
+        """返回颜色的调色板下标，新颜色加入调色板，调色板已满时使用最接近的颜色"""
+        color = tuple(int(c) for c in color)
+        index = self.color_indices.get(color)
+        if index is None:
+            if self.size < 256:
+                index = self.size
+                self.palette[index] = color
+                self.size += 1
+                self.color_indices[color] = index
+            else:
+                # 调色板已满时不缓存，否则任意颜色都会让查找表一直增长
+                distances = ((self.palette.astype(np.int32) - color) ** 2).sum(axis=1)
+                index = int(distances.argmin())
+        return index
+
+    def draw_line(self, start, end, color, thickness):
+        # 单通道上画线不做抗锯齿，像素值始终是有效的调色板下标
+        cv2.line(self.indices, start, end, self.color_index(color), thickness)
+
+    def clear(self):
+        self.indices.fill(self.color_index((255, 255, 255)))
+
+    def to_bgr(self):
+        """展开为新的BGR数组"""
+        return self.palette[self.indices]
+
+    def quantizer(self):
+        """返回把BGR图片量化为调色板下标的函数，持有当前调色板的副本，可以在线程池中调用
+
+        调色板只会追加颜色，转换期间新加入的颜色不影响已有的下标。
+        """
+        height, width = self.height, self.width
+        palette = self.palette[:self.size].copy()
+        return lambda image: quantize_to_palette(image[:height, :width], palette)
+
+    def load_quantized(self, indices):
+        self.indices = indices
+
+    def load_bgr(self, image):
+        """把BGR图片量化到调色板中最接近的颜色"""
+        self.load_quantized(self.quantizer()(image))
+
+    def snapshot(self, x=0, y=0, width=None, height=None):
+        """复制下标（或其中一块区域）和当前调色板供线程池编码"""
+        region = self.indices[y:y + (height or self.height), x:x + (width or self.width)].copy()
+        return region, self.palette[:self.size].copy()
+
+    @staticmethod
+    def render(snapshot):
+        indices, palette = snapshot
+        return palette[indices]
+
+    @staticmethod
+    def encode(snapshot, ext=".jpg"):
+        """在线程池中编码快照；PNG直接输出调色板图片，无损且体积很小"""
+        if ext == ".png":
+            return export_palette_png(*snapshot)
+        return cv2.imencode(ext, PaletteCanvas.render(snapshot))[1].tobytes()
+
+def pack_colors(colors):
+    """把BGR颜色数组打包为uint32，便于查表"""
+    colors = colors.astype(np.uint32)
+    return (colors[..., 0] << 16) | (colors[..., 1] << 8) | colors[..., 2]
+
+def quantize_to_palette(image, palette):
+    """把BGR图片量化为调色板下标
+
+    先对图片中出现过的颜色去重，调色板里已有的颜色直接查表，
+    其余颜色分批计算最接近的调色板颜色，临时数组的大小与图片尺寸无关。
+    """
+    image = np.asarray(image, dtype=np.uint8)
+    colors, inverse = np.unique(pack_colors(image).ravel(), return_inverse=True)
+    keys = pack_colors(palette)
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    positions = np.minimum(np.searchsorted(sorted_keys, colors), len(sorted_keys) - 1)
+    exact = sorted_keys[positions] == colors
+    result = np.empty(len(colors), dtype=np.uint8)
+    result[exact] = order[positions[exact]]
+    missing = np.flatnonzero(~exact)
+    if len(missing):
+        palette = palette.astype(np.int32)
+        packed = colors[missing]
+        unpacked = np.stack([(packed >> 16) & 0xFF, (packed >> 8) & 0xFF, packed & 0xFF], axis=1).astype(np.int32)
+        for start in range(0, len(missing), QUANTIZE_CHUNK):
+            chunk = unpacked[start:start + QUANTIZE_CHUNK]
+            distances = ((chunk[:, None, :] - palette[None, :, :]) ** 2).sum(axis=2)
+            result[missing[start:start + QUANTIZE_CHUNK]] = distances.argmin(axis=1)
+    return result[inverse].reshape(image.shape[:2])
+
+def export_palette_png(indices, palette):
+    """导出调色板PNG，颜色不超过16种时每个像素只占4位或更少"""
+    from PIL import Image
+    image = Image.fromarray(indices)
+    # PIL调色板为RGB顺序，设置调色板后图片变为P模式
+    image.putpalette(palette[:, ::-1].reshape(-1).tolist())
+    colors = len(palette)
+    bits = 1 if colors <= 2 else 2 if colors <= 4 else 4 if colors <= 16 else 8
+    output = io.BytesIO()
+    image.save(output, format="PNG", optimize=True, bits=bits)
+    return output.getvalue()
+
+def create_canvas(backend="bgr", height=480, width=640):
+    """按名称创建画布存储：bgr 或 palette"""
+    if backend == "palette":
+        return PaletteCanvas(height, width)
+    if backend == "bgr":
+        return BGRCanvas(height, width)
+    raise ValueError(f"未知的画布类型: {backend}")
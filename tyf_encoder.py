@@ -0,0 +1,70 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from tyf_metrics import encode_seconds
+
+# 画布编码线程池：cv2.imencode 执行时会释放GIL，多个线程可以同时利用多个CPU核心
+
+def encode_image(image, ext=".jpg"):
+    """编码图片，返回字节数据"""
+    with encode_seconds.time(ext):
+        ok, buffer = cv2.imencode(ext, image)
+    if not ok:
+        raise ValueError(f"图片编码失败: {ext}")
+    return buffer.tobytes()
+
+def encode_tiles(encode, tiles, ext=".jpg"):
+    """编码多个分块，tiles为 [(x, y, 画布快照)]，encode为画布存储的编码函数"""
+    return [{"x": x, "y": y, "image": timed_encode(encode, tile, ext)} for x, y, tile in tiles]
+
+def timed_encode(encode, snapshot, ext=".jpg"):
+    """调用画布存储的编码函数并记录耗时"""
+    with encode_seconds.time(ext):
+        return encode(snapshot, ext)
+
+def encode_thumbnail(render, snapshot, width, ext=".jpg"):
+    """把画布快照缩小到指定宽度后编码，render为画布存储把快照展开为BGR的函数"""
+    image = render(snapshot)
+    height = max(round(image.shape[0] * width / image.shape[1]), 1)
+    return encode_image(cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA), ext)
+
+class CanvasEncoder:
+    """把画布编码交给线程池执行，事件循环只负责等待结果"""
+    def __init__(self, max_workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="canvas-encoder")
+
+    def submit(self, func, *args):
+        """在线程池中执行函数，返回asyncio.Future；调用方需自行保证参数在执行期间不被修改"""
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class VersionedEncodeCache:
+    """按画布版本缓存编码任务，同一版本的并发请求共享同一次编码"""
+    def __init__(self, encoder):
+        self.encoder = encoder
+        self.latest = {}  # 格式（缩略图为(格式, 宽度)） -> (版本, Future)
+
+    def get(self, version, board, ext=".jpg"):
+        """返回该版本画布编码结果的可等待对象；画布在调用时立即复制，之后修改画布不影响结果"""
+        return self.get_or_submit(ext, version, lambda: (timed_encode, board.encode, board.snapshot(), ext))
+
+    def get_thumbnail(self, version, board, width, ext=".jpg"):
+        """返回该版本画布缩略图编码结果的可等待对象"""
+        return self.get_or_submit((ext, width), version, lambda: (encode_thumbnail, board.render, board.snapshot(), width, ext))
+
+    def get_or_submit(self, key, version, make_job):
+        """同一键同一版本只提交一次任务；make_job返回 (函数, 参数...)，只在需要提交时调用"""
+        cached = self.latest.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, self.encoder.submit(*make_job()))
+            self.latest[key] = cached
+        # shield: 某个等待者被取消时不影响其他共享结果的等待者
+        return asyncio.shield(cached[1])
+
+# 进程内共享的编码线程池，线程数可通过ENCODER_THREADS设置
+canvas_encoder = CanvasEncoder(int(os.environ.get("ENCODER_THREADS", 0)) or None)
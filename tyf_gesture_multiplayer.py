@@ -10,6 +10,12 @@ from PIL import ImageFont, ImageDraw, Image
 import asyncio
 import websockets
 
+def guess_result_text(guess):
+    """猜测结果的显示文字，服务器会标出接近正确答案的猜测"""
+    if guess["is_correct"]:
+        return "正确"
+    return "接近了" if guess.get("match") == "close" else "错误"
+
 class GestureMultiplayerGame:
     def __init__(self):
         # 初始化MediaPipe手部检测
@@ -58,6 +64,8 @@ class GestureMultiplayerGame:
         # WebSocket客户端
         self.websocket = None
         self.ws_connected = False
+        self.room_id = "default"  # 要加入的房间号
+        self.pending_points = []  # 待发送的绘制点，每处理完一帧批量发送一次
         self.current_word = ""
         self.is_game_active = True
         self.guesses = []
@@ -118,9 +126,9 @@ class GestureMultiplayerGame:
         
         while retries < max_retries and not self.ws_connected:
             try:
-                self.websocket = await websockets.connect(server_url)
+                self.websocket = await websockets.connect(f"{server_url}?room={self.room_id}")
                 self.ws_connected = True
-                print(f"已连接到服务器: {server_url}")
+                print(f"已连接到服务器: {server_url}，房间: {self.room_id}")
                 retries = 0  # 重置重试计数
                 
                 # 注册为画画的人
@@ -144,17 +152,27 @@ class GestureMultiplayerGame:
     
     async def handle_message(self, data):
         """处理接收到的消息"""
-        if data["type"] == "game_state":
+        if data["type"] == "ping":
+            # 回复服务器心跳，长时间不回复的连接会被断开
+            await self.websocket.send(json.dumps({"type": "pong", "t": data["t"]}))
+        elif data["type"] == "game_state":
             self.current_word = data["current_word"]
+            # 加入时服务器发送完整的猜测记录，之后只发送新增的猜测
+            if "guesses" in data:
+                self.guesses = [
+                    {"guess": record["guess"], "is_correct": record["is_correct"], "match": record.get("match")}
+                    for record in data["guesses"]
+                ]
             self.is_game_active = data["is_game_active"]
             print(f"当前词: {self.current_word}")
         elif data["type"] == "guess_result":
             # 更新猜测记录
             self.guesses.append({
                 "guess": data["guess"],
-                "is_correct": data["is_correct"]
+                "is_correct": data["is_correct"],
+                "match": data.get("match")
             })
-            print(f"猜测: {data['guess']}, 结果: {'正确' if data['is_correct'] else '错误'}")
+            print(f"猜测: {data['guess']}, 结果: {guess_result_text(self.guesses[-1])}")
             
             # 如果猜测正确，显示正确答案
             if data["is_correct"]:
@@ -169,16 +187,25 @@ class GestureMultiplayerGame:
             print(f"游戏重置，新词: {self.current_word}")
     
     async def send_draw_update(self, x, y, drawing):
-        """发送绘制更新到服务器，包含颜色信息"""
+        """记录绘制更新，包含颜色信息，由flush_draw_updates批量发送"""
+        self.pending_points.append({
+            "x": x,
+            "y": y,
+            "drawing": drawing,
+            "color": list(self.draw_color)  # 发送当前颜色，转换为列表格式
+        })
+    
+    async def flush_draw_updates(self):
+        """把本帧累积的绘制点合并为一条draw_batch消息发送"""
+        if not self.pending_points:
+            return
+        points = self.pending_points
+        self.pending_points = []
         if self.ws_connected:
             try:
-                # 发送绘制更新，包含当前颜色
                 await self.websocket.send(json.dumps({
-                    "type": "draw",
-                    "x": x,
-                    "y": y,
-                    "drawing": drawing,
-                    "color": list(self.draw_color)  # 发送当前颜色，转换为列表格式
+                    "type": "draw_batch",
+                    "points": points
                 }))
             except Exception as e:
                 print(f"发送绘制更新失败: {e}")
@@ -186,6 +213,7 @@ class GestureMultiplayerGame:
     
     async def send_clear_canvas(self):
         """发送清空画布命令到服务器"""
+        await self.flush_draw_updates()
         if self.ws_connected:
             try:
                 await self.websocket.send(json.dumps({
@@ -509,7 +537,7 @@ class GestureMultiplayerGame:
             start_y = 420 if self.hint else 390
             frame = self.draw_chinese_text(frame, "猜测记录:", (10, start_y), font_size=16, color=(255, 165, 0))
             for i, guess in enumerate(self.guesses[-3:]):  # 只显示最近3个猜测
-                result = "正确" if guess["is_correct"] else "错误"
+                result = guess_result_text(guess)
                 frame = self.draw_chinese_text(frame, f"{i+1}. {guess['guess']} - {result}", (10, start_y + 30 + i*30), font_size=14, color=(255, 165, 0))
         
         # 显示正确答案（当猜测正确时）
@@ -521,6 +549,9 @@ class GestureMultiplayerGame:
         # 合并画布和摄像头画面
         combined = np.hstack((frame, self.canvas))
         
+        # 每处理完一帧批量发送本帧的绘制点
+        await self.flush_draw_updates()
+        
         return combined
     
     async def run(self):
@@ -0,0 +1,247 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import urllib.request
+from collections import OrderedDict, deque
+
+import cv2
+import numpy as np
+
+from tyf_metrics import ai_guesses
+
+# 服务器端AI猜词：各房间的请求先排队，再按房间轮流取出组成批次交给视觉模型
+# 结果按画面内容的哈希缓存，画面没有变化时重复请求直接返回缓存
+# 每个房间同时进行的请求数有上限，一个房间频繁请求不会挤占其他房间
+
+# 视觉模型接口（OpenAI兼容），未设置AI_GUESS_API_KEY时AI猜词不可用
+AI_GUESS_API_BASE = os.environ.get("AI_GUESS_API_BASE", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+AI_GUESS_MODEL = os.environ.get("AI_GUESS_MODEL", "qwen-vl-plus")
+# 每批最多的图片数，以及等待凑满一批的最长时间（秒）
+AI_GUESS_BATCH_SIZE = int(os.environ.get("AI_GUESS_BATCH_SIZE", 8))
+AI_GUESS_BATCH_WAIT = float(os.environ.get("AI_GUESS_BATCH_WAIT", 0.05))
+# 同时发往视觉模型的批次数上限
+AI_GUESS_MAX_BATCHES = int(os.environ.get("AI_GUESS_MAX_BATCHES", 2))
+# 每个房间同时进行的请求数上限
+AI_GUESS_ROOM_CONCURRENCY = int(os.environ.get("AI_GUESS_ROOM_CONCURRENCY", 1))
+# 缓存的结果数
+AI_GUESS_CACHE_SIZE = 1024
+
+SYSTEM_PROMPT = "你是一个专业的图像识别助手，请根据图片中的手绘内容，猜测画的是什么物体。请只用一个词或短语回答，不要有任何解释。"
+
+class GuessBackend:
+    """视觉模型接口：一次猜测一批图片，images为JPEG数据列表，hints为对应的提示词列表"""
+    async def guess_batch(self, images, hints):
+        raise NotImplementedError
+
+class LocalGuessBackend(GuessBackend):
+    """本地替身，不调用外部服务，只用于测试
+
+    空白画布返回"空白"，否则按画面内容从候选词中确定地选一个。
+    """
+    def __init__(self, candidates=("苹果", "猫", "房子", "太阳", "汽车")):
+        self.candidates = list(candidates)
+        self.calls = 0  # 调用次数，测试时用来确认批处理和缓存
+
+    async def guess_batch(self, images, hints):
+        self.calls += 1
+        return [self.guess(image) for image in images]
+
+    def guess(self, image):
+        pixels = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if pixels is None or pixels.min() > 200:
+            return "空白"
+        digest = hashlib.blake2b(image, digest_size=4).digest()
+        return self.candidates[int.from_bytes(digest, "little") % len(self.candidates)]
+
+class OpenAIGuessBackend(GuessBackend):
+    """OpenAI兼容的对话接口，一次请求中携带一批图片，要求按顺序每行回答一个词"""
+    def __init__(self, api_key, api_base=AI_GUESS_API_BASE, model=AI_GUESS_MODEL, timeout=30):
+        self.api_key = api_key
+        self.api_base = api_base.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+
+    async def guess_batch(self, images, hints):
+        content = [{"type": "text", "text": f"下面有{len(images)}张手绘图片，请按顺序每行回答一张图片画的是什么，共{len(images)}行。"}]
+        for i, (image, hint) in enumerate(zip(images, hints), 1):
+            text = f"第{i}张" + (f"，提示词: {hint}" if hint else "")
+            content.append({"type": "text", "text": text})
+            content.append({"type": "image_url", "image_url": {"url": "data:image/jpeg;base64," + base64.b64encode(image).decode('utf-8')}})
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": content}
+            ],
+            "max_tokens": 20 * len(images)
+        }
+        # 使用标准库发送请求，在线程中执行以免阻塞事件循环
+        result = await asyncio.to_thread(self.post, "/chat/completions", payload)
+        lines = [line.strip() for line in result["choices"][0]["message"]["content"].strip().splitlines() if line.strip()]
+        # 去掉模型可能加上的编号
+        answers = [line.split(".", 1)[-1].split("、", 1)[-1].split(":", 1)[-1].strip() for line in lines]
+        return (answers + [""] * len(images))[:len(images)]
+
+    def post(self, path, payload):
+        request = urllib.request.Request(
+            self.api_base + path,
+            data=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+class GuessRequest:
+    __slots__ = ("key", "image", "hint", "future")
+
+    def __init__(self, key, image, hint, future):
+        self.key = key
+        self.image = image
+        self.hint = hint
+        self.future = future
+
+class GuesserService:
+    """排队、批处理并缓存AI猜词请求"""
+    def __init__(self, backend, batch_size=AI_GUESS_BATCH_SIZE, batch_wait=AI_GUESS_BATCH_WAIT,
+                 room_concurrency=AI_GUESS_ROOM_CONCURRENCY, cache_size=AI_GUESS_CACHE_SIZE,
+                 max_batches=AI_GUESS_MAX_BATCHES):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.room_concurrency = room_concurrency
+        self.cache = OrderedDict()  # 画面哈希 -> 结果，最近使用的在末尾
+        self.cache_size = cache_size
+        self.inflight = {}  # 画面哈希 -> 进行中的Future，相同画面的请求共享结果
+        self.queues = OrderedDict()  # 房间号 -> 等待中的请求队列，按房间轮流取出
+        self.room_slots = {}  # 房间号 -> [信号量, 使用中和等待中的请求数]
+        self.batch_slots = asyncio.Semaphore(max_batches)
+        self.wakeup = asyncio.Event()
+        self.worker_task = None
+        self.batch_tasks = set()
+        self.cache_hits = 0
+        self.batches = 0
+
+    def start(self):
+        """启动批处理任务，可重复调用"""
+        if self.worker_task is None or self.worker_task.done():
+            self.worker_task = asyncio.create_task(self.worker_loop())
+
+    def close(self):
+        if self.worker_task is not None:
+            self.worker_task.cancel()
+            self.worker_task = None
+
+    @staticmethod
+    def cache_key(image, hint=""):
+        return hashlib.blake2b(image + b"\0" + hint.encode('utf-8'), digest_size=16).digest()
+
+    async def guess(self, room_id, image, hint=""):
+        """猜测一幅画面（JPEG数据），返回猜测的词"""
+        key = self.cache_key(image, hint)
+        if key in self.cache:
+            self.cache_hits += 1
+            ai_guesses.inc("cache")
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        future = self.inflight.get(key)
+        if future is not None:
+            ai_guesses.inc("shared")
+            return await asyncio.shield(future)
+
+        slots = self.room_slots.get(room_id)
+        if slots is None:
+            slots = self.room_slots[room_id] = [asyncio.Semaphore(self.room_concurrency), 0]
+        slots[1] += 1
+        try:
+            async with slots[0]:
+                return await self.submit(room_id, key, image, hint)
+        finally:
+            slots[1] -= 1
+            if slots[1] == 0:
+                del self.room_slots[room_id]
+
+    async def submit(self, room_id, key, image, hint):
+        """把请求放入房间的队列并等待结果"""
+        # 等待名额期间相同画面可能已经有了结果
+        if key in self.cache:
+            self.cache_hits += 1
+            ai_guesses.inc("cache")
+            return self.cache[key]
+        future = self.inflight.get(key)
+        if future is not None:
+            ai_guesses.inc("shared")
+        else:
+            ai_guesses.inc("backend")
+            future = asyncio.get_running_loop().create_future()
+            self.inflight[key] = future
+            self.queues.setdefault(room_id, deque()).append(GuessRequest(key, image, hint, future))
+            self.start()
+            self.wakeup.set()
+        return await asyncio.shield(future)
+
+    def take_batch(self):
+        """按房间轮流取出请求，每个房间每轮最多一个"""
+        batch = []
+        while self.queues and len(batch) < self.batch_size:
+            room_id, queue = next(iter(self.queues.items()))
+            batch.append(queue.popleft())
+            del self.queues[room_id]
+            if queue:
+                # 还有请求的房间排到队尾
+                self.queues[room_id] = queue
+        return batch
+
+    async def worker_loop(self):
+        while True:
+            while not self.queues:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            # 稍等片刻，让同时到达的请求凑成一批
+            await asyncio.sleep(self.batch_wait)
+            await self.batch_slots.acquire()
+            batch = self.take_batch()
+            if not batch:
+                self.batch_slots.release()
+                continue
+            self.batches += 1
+            task = asyncio.create_task(self.run_batch(batch))
+            self.batch_tasks.add(task)
+            task.add_done_callback(self.batch_tasks.discard)
+
+    async def run_batch(self, batch):
+        """把一批请求交给视觉模型，并把结果写入缓存"""
+        answers = None
+        try:
+            answers = await self.backend.guess_batch([r.image for r in batch], [r.hint for r in batch])
+            if len(answers) != len(batch):
+                raise ValueError(f"返回了{len(answers)}个结果，应为{len(batch)}个")
+        except Exception as e:
+            print(f"AI猜词失败: {e}")
+            answers = None
+        finally:
+            # 无论成功、失败还是被取消，每个请求都要得到结果，否则等待的房间会一直占着名额
+            for i, request in enumerate(batch):
+                self.inflight.pop(request.key, None)
+                if request.future.done():
+                    continue
+                if answers is None:
+                    # 失败的结果不缓存，下次请求重试
+                    request.future.set_result("猜测失败，请重试")
+                    continue
+                self.cache[request.key] = answers[i]
+                request.future.set_result(answers[i])
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            self.batch_slots.release()
+
+def create_guesser_service():
+    """设置了AI_GUESS_API_KEY时使用视觉模型，否则返回None
+
+    本地替身的回答与画面无关，不能当作真实的猜测，未配置时AI猜词直接不可用。
+    """
+    api_key = os.environ.get("AI_GUESS_API_KEY")
+    if not api_key:
+        return None
+    return GuesserService(OpenAIGuessBackend(api_key))
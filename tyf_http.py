@@ -0,0 +1,56 @@
+import gzip
+import hashlib
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+# HTTP响应辅助：预压缩的静态内容和基于ETag的条件请求
+# brotli为可选依赖，未安装时只提供gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def etag_matches(request: Request, etag):
+    """请求的If-None-Match是否包含该ETag（弱比较）"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    value = etag.removeprefix("W/")
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == value:
+            return True
+    return False
+
+def accepted_encodings(request: Request):
+    """Accept-Encoding中可接受的编码集合（忽略q=0）"""
+    encodings = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        if name and params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            encodings.add(name.lower())
+    return encodings
+
+class CompressedBody:
+    """启动时压缩好的响应体，按Accept-Encoding选择br、gzip或原文，并带ETag"""
+    def __init__(self, body: bytes, media_type):
+        self.media_type = media_type
+        # 各种编码的内容相同，使用弱ETag
+        self.etag = f'W/"{hashlib.sha256(body).hexdigest()[:16]}"'
+        self.variants = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=11)
+        self.body = body
+
+    def response(self, request: Request):
+        headers = {"ETag": self.etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+        if etag_matches(request, self.etag):
+            return Response(status_code=304, headers=headers)
+        accepted = accepted_encodings(request)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and encoding in accepted:
+                headers["Content-Encoding"] = encoding
+                return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+        return Response(self.body, media_type=self.media_type, headers=headers)
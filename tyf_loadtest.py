@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+# 压力测试：在本地启动服务器，模拟若干画画的人和猜词的人，使用真实的 /ws 协议
+# 报告每秒消息数、画画的人到猜词者的延迟（p50/p99）、服务器每个连接的CPU和内存占用
+# 例如：python tyf_loadtest.py --drawers 10 --guessers 90 --duration 30
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def free_port():
+    """找一个空闲的本地端口"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(port, workdir, env=None):
+    """在子进程中启动服务器，工作目录workdir为临时目录，避免在仓库中写入文件"""
+    server_env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    server_env.update(env or {})
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "tyf_multiplayer:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir,
+        env=server_env
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服务器启动失败，退出码 {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    process.wait(timeout=10)
+    raise RuntimeError("等待服务器启动超时")
+
+class ProcessSampler:
+    """读取进程的CPU时间和常驻内存，优先使用psutil，否则读取/proc"""
+    def __init__(self, pid):
+        self.pid = pid
+        try:
+            import psutil
+            self.process = psutil.Process(pid)
+        except ImportError:
+            self.process = None
+        self.baseline_rss = None  # 模拟客户端连接前的常驻内存
+
+    def cpu_seconds(self):
+        if self.process is not None:
+            times = self.process.cpu_times()
+            return times.user + times.system
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def rss_bytes(self):
+        if self.process is not None:
+            return self.process.memory_info().rss
+        try:
+            with open(f"/proc/{self.pid}/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return None
+
+def stroke_trace(width=640, height=480, points=60):
+    """生成一笔接近手绘的曲线：随机起点、缓慢变化的方向和少量抖动"""
+    x, y = random.uniform(80, width - 80), random.uniform(80, height - 80)
+    angle = random.uniform(0, 2 * math.pi)
+    trace = []
+    for _ in range(points):
+        angle += random.gauss(0, 0.25)
+        step = random.uniform(3, 8)
+        x = min(max(x + math.cos(angle) * step + random.gauss(0, 0.5), 1), width - 1)
+        y = min(max(y + math.sin(angle) * step + random.gauss(0, 0.5), 1), height - 1)
+        trace.append((int(x), int(y)))
+    return trace
+
+class Stats:
+    """汇总所有模拟客户端的计数和延迟"""
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.received_by_type = {}
+        self.latencies = []
+        self.errors = 0
+
+    def record_received(self, message_type):
+        self.received += 1
+        self.received_by_type[message_type] = self.received_by_type.get(message_type, 0) + 1
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+class RoomTrace:
+    """一个房间内画画的人发出各点的时间，猜词者收到线段终点时据此计算延迟"""
+    def __init__(self):
+        self.sent_at = {}  # (x, y) -> 发送时间
+
+    def mark(self, x, y):
+        self.sent_at[(x, y)] = time.perf_counter()
+
+    def latency(self, x, y):
+        # 同一房间的每个猜词者都会收到这条线段，因此不删除记录；画布大小限制了记录数量
+        sent = self.sent_at.get((x, y))
+        return None if sent is None else time.perf_counter() - sent
+
+async def run_drawer(url, trace, stats, stop, args):
+    """模拟画画的人：按固定频率回放曲线，偶尔清空画布或重置游戏"""
+    async with websockets.connect(url, max_size=None) as ws:
+        await ws.send(json.dumps({"type": "register", "role": "drawer"}))
+        stats.sent += 1
+        reader = asyncio.create_task(drain(ws, stats))
+        interval = 1.0 / args.rate
+        strokes = 0
+        try:
+            while not stop.is_set():
+                points = stroke_trace()
+                for i, (x, y) in enumerate(points):
+                    if stop.is_set():
+                        break
+                    trace.mark(x, y)
+                    await ws.send(json.dumps({"type": "draw", "x": x, "y": y, "drawing": i < len(points) - 1}))
+                    stats.sent += 1
+                    await asyncio.sleep(interval)
+                strokes += 1
+                if args.clear_every and strokes % args.clear_every == 0:
+                    await ws.send(json.dumps({"type": "clear"}))
+                    stats.sent += 1
+                if args.reset_every and strokes % args.reset_every == 0:
+                    await ws.send(json.dumps({"type": "reset"}))
+                    stats.sent += 1
+        finally:
+            reader.cancel()
+
+async def drain(ws, stats):
+    """读取并丢弃服务器发给画画的人的消息"""
+    try:
+        async for message in ws:
+            if isinstance(message, bytes):
+                stats.record_received("binary")
+                continue
+            data = json.loads(message)
+            stats.record_received(data.get("type"))
+            await answer_ping(ws, data)
+    except websockets.ConnectionClosed:
+        pass
+
+async def answer_ping(ws, data):
+    """回复服务器心跳"""
+    if data.get("type") == "ping":
+        await ws.send(json.dumps({"type": "pong", "t": data["t"]}))
+
+async def run_guesser(url, trace, stats, stop, args):
+    """模拟猜词者：接收画布消息计算延迟，并定期发送猜测"""
+    async with websockets.connect(url, max_size=None) as ws:
+        await ws.send(json.dumps({"type": "register", "role": "guesser"}))
+        stats.sent += 1
+        guesser = asyncio.create_task(send_guesses(ws, stats, stop, args))
+        try:
+            while not stop.is_set():
+                try:
+                    message = await asyncio.wait_for(ws.recv(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    continue
+                data = json.loads(message)
+                stats.record_received(data.get("type"))
+                await answer_ping(ws, data)
+                if data.get("type") == "stroke":
+                    for segment in data["segments"]:
+                        latency = trace.latency(*segment["to"])
+                        if latency is not None:
+                            stats.latencies.append(latency)
+        except websockets.ConnectionClosed:
+            stats.errors += 1
+        finally:
+            guesser.cancel()
+
+async def send_guesses(ws, stats, stop, args):
+    words = ["苹果", "猫", "汽车", "太阳", "房子"]
+    while not stop.is_set() and args.guess_interval > 0:
+        await asyncio.sleep(random.uniform(0.5, 1.5) * args.guess_interval)
+        await ws.send(json.dumps({"type": "guess", "guess": random.choice(words)}))
+        stats.sent += 1
+
+async def run_load(args, sampler=None):
+    """按房间分配客户端并运行指定时长，返回统计结果"""
+    stats = Stats()
+    stop = asyncio.Event()
+    rooms = max(args.drawers, 1)
+    tasks = []
+    traces = [RoomTrace() for _ in range(rooms)]
+    for i in range(args.guessers):
+        room = i % rooms
+        tasks.append(asyncio.create_task(run_guesser(f"{args.url}?room=load{room}", traces[room], stats, stop, args)))
+    await asyncio.sleep(0.5)  # 先让猜词者加入，避免错过开头的线段
+    for room in range(args.drawers):
+        tasks.append(asyncio.create_task(run_drawer(f"{args.url}?room=load{room}", traces[room], stats, stop, args)))
+
+    cpu_start = sampler.cpu_seconds() if sampler else None
+    start = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    stop.set()
+    elapsed = time.perf_counter() - start
+    cpu_end = sampler.cpu_seconds() if sampler else None
+    rss = sampler.rss_bytes() if sampler else None
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, Exception):
+            stats.errors += 1
+            print(f"模拟客户端异常: {result!r}")
+
+    report = {
+        "elapsed": elapsed,
+        "connections": args.drawers + args.guessers,
+        "sent_per_second": stats.sent / elapsed,
+        "received_per_second": stats.received / elapsed,
+        "received_by_type": stats.received_by_type,
+        "latency_samples": len(stats.latencies),
+        "latency_p50_ms": None,
+        "latency_p99_ms": None,
+        "server_cpu_percent": None,
+        "server_rss_mb": None,
+        "errors": stats.errors
+    }
+    if stats.latencies:
+        report["latency_p50_ms"] = percentile(stats.latencies, 0.50) * 1000
+        report["latency_p99_ms"] = percentile(stats.latencies, 0.99) * 1000
+    if cpu_start is not None and cpu_end is not None:
+        report["server_cpu_percent"] = (cpu_end - cpu_start) / elapsed * 100
+        report["server_cpu_ms_per_connection_second"] = (cpu_end - cpu_start) * 1000 / elapsed / max(report["connections"], 1)
+    if rss is not None:
+        report["server_rss_mb"] = rss / 2 ** 20
+        if sampler.baseline_rss is not None:
+            report["server_rss_kb_per_connection"] = (rss - sampler.baseline_rss) / 1024 / max(report["connections"], 1)
+    return report
+
+def print_report(report):
+    def fmt(value, unit=""):
+        return "n/a" if value is None else f"{value:.2f}{unit}"
+    print(f"连接数: {report['connections']}，运行时长: {report['elapsed']:.1f}s，错误: {report['errors']}")
+    print(f"发送: {report['sent_per_second']:.0f} 条/秒，接收: {report['received_per_second']:.0f} 条/秒")
+    print(f"接收消息类型: {report['received_by_type']}")
+    print(f"画画到猜词延迟: p50 {fmt(report['latency_p50_ms'], 'ms')}，p99 {fmt(report['latency_p99_ms'], 'ms')}（{report['latency_samples']} 个样本）")
+    print(f"服务器CPU: {fmt(report['server_cpu_percent'], '%')}，每连接 {fmt(report.get('server_cpu_ms_per_connection_second'), 'ms/s')}")
+    print(f"服务器内存: {fmt(report['server_rss_mb'], 'MB')}，每连接 {fmt(report.get('server_rss_kb_per_connection'), 'KB')}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="你画我猜服务器压力测试")
+    parser.add_argument("--drawers", type=int, default=4, help="画画的人数，每人一个房间")
+    parser.add_argument("--guessers", type=int, default=16, help="猜词的人数，平均分到各房间")
+    parser.add_argument("--duration", type=float, default=10, help="运行秒数")
+    parser.add_argument("--rate", type=float, default=60, help="每个画画的人每秒发送的点数")
+    parser.add_argument("--guess-interval", type=float, default=2.0, help="猜词者发送猜测的平均间隔（秒），0为不猜")
+    parser.add_argument("--clear-every", type=int, default=20, help="每画多少笔清空一次画布，0为不清空")
+    parser.add_argument("--reset-every", type=int, default=0, help="每画多少笔重置一次游戏，0为不重置")
+    parser.add_argument("--url", help="已运行服务器的WebSocket地址，不指定时在本地启动服务器")
+    parser.add_argument("--timelapse", action="store_true", help="本地启动的服务器照常渲染延时回放（会计入服务器以外进程的CPU）")
+    parser.add_argument("--json", action="store_true", help="以JSON格式输出结果")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    process = None
+    sampler = None
+    # 本地服务器的工作目录（笔画日志等），结束后删除
+    workdir = tempfile.TemporaryDirectory(prefix="tyf_loadtest_") if args.url is None else None
+    try:
+        if workdir is not None:
+            port = free_port()
+            # 延时回放在后台进程中渲染，与压力测试无关，默认关闭以免影响CPU读数
+            process = start_server(port, workdir.name, None if args.timelapse else {"TIMELAPSE_WORKERS": "0"})
+            args.url = f"ws://127.0.0.1:{port}/ws"
+            sampler = ProcessSampler(process.pid)
+            sampler.baseline_rss = sampler.rss_bytes()
+        report = asyncio.run(run_load(args, sampler))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        if workdir is not None:
+            workdir.cleanup()
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    return report
+
+if __name__ == "__main__":
+    main()
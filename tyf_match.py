@@ -0,0 +1,131 @@
+import importlib.util
+import threading
+import unicodedata
+import weakref
+
+# pypinyin用于生成词语的拼音和判断同音字；未安装时只能按词库中写成别名的拼音匹配，内置词库都带有拼音别名
+# 导入pypinyin较慢，第一次生成拼音时才导入，不增加服务器的启动时间
+PINYIN_AVAILABLE = importlib.util.find_spec("pypinyin") is not None
+
+# 猜词匹配：每个词库建立一次索引，把词语、别名和拼音的规范化形式映射到词语，
+# 判断一次猜测只需把猜测规范化后查表，与词库大小无关
+# 规范化：全角转半角（NFKC）、去掉空白和标点、大小写折叠、去掉拉丁字母的声调、繁体转简体
+# 结果分为三种：
+#   正确：与词语、别名或拼音相同
+#   接近：是词语或别名的一部分（至少两个字）、包含了词语或别名、或与词语同音（需要pypinyin）
+#   错误：其他情况
+
+CORRECT = "correct"
+CLOSE = "close"
+WRONG = "wrong"
+
+# 猜测最多参与匹配的字符数，超出部分忽略
+GUESS_MAX_LENGTH = 32
+# 作为"接近"的词语片段的最少字数
+CLOSE_MIN_LENGTH = 2
+
+# 匹配时忽略的字符类别：标点、分隔符（空白）、控制字符、符号
+IGNORED_CATEGORIES = frozenset("PZCS")
+
+# 常用繁体字到简体字的对照，覆盖词库中的常见字
+TRADITIONAL = (
+    "蘋車機馬貓電腦視鏡傘陽氣籃樹飛遊動車輪單腳鐵書畫間門開關長東見貝頁風雲"
+    "魚鳥龍龜點熱愛國發會學實來時後裏裡麼們這說話語請讓認識讀寫聽覺買賣錢鐘"
+    "錶燈線紙筆襪褲裙帶韓飯麵麥蝦雞鴨鵝豬蟲螞蟻蝴蝶瑪鋼銀鍋壺盤碗湯餅蛋糕"
+    "橋樓廳廚窗牆園場級報網頭臉齒舊筆號簡體"
+)
+SIMPLIFIED = (
+    "苹车机马猫电脑视镜伞阳气篮树飞游动车轮单脚铁书画间门开关长东见贝页风云"
+    "鱼鸟龙龟点热爱国发会学实来时后里里么们这说话语请让认识读写听觉买卖钱钟"
+    "表灯线纸笔袜裤裙带韩饭面麦虾鸡鸭鹅猪虫蚂蚁蝴蝶玛钢银锅壶盘碗汤饼蛋糕"
+    "桥楼厅厨窗墙园场级报网头脸齿旧笔号简体"
+)
+TRADITIONAL_TABLE = str.maketrans(TRADITIONAL, SIMPLIFIED)
+
+def fold_char(char):
+    """去掉拉丁字母上的声调等符号，例如拼音 lán -> lan"""
+    if "À" <= char <= "ɏ":
+        return unicodedata.normalize("NFKD", char)[0]
+    return char
+
+def normalize(text):
+    """猜测和词语的规范化形式"""
+    text = unicodedata.normalize("NFKC", text[:GUESS_MAX_LENGTH]).casefold()
+    return "".join(
+        fold_char(char) for char in text
+        if unicodedata.category(char)[0] not in IGNORED_CATEGORIES
+    ).translate(TRADITIONAL_TABLE)
+
+def spell(text):
+    """不带声调的拼音，未安装pypinyin时返回空字符串"""
+    if not PINYIN_AVAILABLE:
+        return ""
+    from pypinyin import lazy_pinyin
+    return normalize("".join(lazy_pinyin(text)))
+
+class GuessMatcher:
+    """一个词库的猜词匹配索引，spellings为与words对应的拼音列表（例如词库缓存中保存的），为None时现场生成"""
+    def __init__(self, words, aliases=None, spellings=None):
+        aliases = aliases or {}
+        self.exact = {}  # 规范化的词语、别名、拼音 -> 词语集合
+        self.close = {}  # 词语和别名的片段 -> 词语集合
+        self.keys = {}  # 词语 -> 规范化的词语和别名，用于判断猜测是否包含了词语
+        for i, word in enumerate(words):
+            keys = {normalize(text) for text in (word, *aliases.get(word, ()))}
+            keys.discard("")
+            self.keys[word] = tuple(keys)
+            for key in keys:
+                self.exact.setdefault(key, set()).add(word)
+                if not key.isascii():
+                    for fragment in fragments(key):
+                        self.close.setdefault(fragment, set()).add(word)
+            spelled = spellings[i] if spellings is not None else spell(word)
+            if spelled:
+                self.exact.setdefault(spelled, set()).add(word)
+
+    @classmethod
+    def from_bank(cls, bank):
+        aliases = {bank.word(index): words for index, words in bank.aliases.items()}
+        return cls(bank.words(), aliases, bank.spellings)
+
+    def match(self, guess, word):
+        """判断猜测与词语的关系，返回 CORRECT、CLOSE 或 WRONG"""
+        key = normalize(guess)
+        if not key:
+            return WRONG
+        if word in self.exact.get(key, ()):
+            return CORRECT
+        if word in self.close.get(key, ()):
+            return CLOSE
+        # 不在词库中的词（例如其他工作进程设置的）只按词语本身判断
+        keys = self.keys.get(word) or (normalize(word),)
+        if key in keys:
+            return CORRECT
+        # 拼音等字母别名太短，包含关系容易误判，只对汉字判断
+        if any(known in key for known in keys if known and not known.isascii()):
+            return CLOSE
+        spelled = spell(key)
+        if spelled and word in self.exact.get(spelled, ()):
+            return CLOSE
+        return WRONG
+
+def fragments(key):
+    """词语中至少CLOSE_MIN_LENGTH个字、且短于整个词语的连续片段"""
+    return {
+        key[start:end]
+        for start in range(len(key))
+        for end in range(start + CLOSE_MIN_LENGTH, len(key) + (start > 0))
+    }
+
+_matchers = weakref.WeakKeyDictionary()
+_matchers_lock = threading.Lock()
+
+def matcher_for(bank):
+    """词库对应的匹配索引，每个词库只建立一次；大词库建立索引较慢，服务器在线程中预先调用"""
+    matcher = _matchers.get(bank)
+    if matcher is None:
+        with _matchers_lock:
+            matcher = _matchers.get(bank)
+            if matcher is None:
+                matcher = _matchers[bank] = GuessMatcher.from_bank(bank)
+    return matcher
@@ -0,0 +1,165 @@
+import bisect
+import threading
+import time
+
+# 服务器运行指标，/metrics 以Prometheus文本格式导出
+# 记录时只做字典查找和加法，直方图用二分查找定位区间，可以在高负载下常开
+# 编码在线程池中执行，直方图用锁保证多线程记录时计数一致
+
+# 默认的耗时区间（秒）
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """指标基类，values按标签值元组保存"""
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values = {}
+
+    def samples(self):
+        """返回 (后缀, 标签文本, 数值) 列表"""
+        return [("", format_labels(self.label_names, key), value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    """只增不减的计数"""
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    """可增可减的数值；指定collect时在导出时调用它获取 {标签值元组: 数值}"""
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, *labels, value):
+        self.values[labels] = value
+
+    def samples(self):
+        if self.collect is not None:
+            self.values = self.collect()
+        return super().samples()
+
+class Histogram(Metric):
+    """按区间统计的分布，例如耗时"""
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+
+    def observe(self, *labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                # 各区间的计数（最后一个为+Inf）、总和
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def time(self, *labels):
+        """用于with语句的计时器"""
+        return HistogramTimer(self, labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(("_bucket", format_labels(self.label_names, key, f'le="{format_value(float(bound))}"'), cumulative))
+            labels = format_labels(self.label_names, key)
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+class HistogramTimer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(*self.labels, value=time.perf_counter() - self.start)
+
+class Registry:
+    """指标集合"""
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), collect=None):
+        return self.register(Gauge(name, help, labels, collect))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """导出Prometheus文本格式"""
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+# 进程内共享的指标
+registry = Registry()
+
+messages_received = registry.counter("tyf_messages_received_total", "收到的客户端消息数", ("type",))
+messages_sent = registry.counter("tyf_messages_sent_total", "发出的消息数", ("type", "format"))
+bytes_sent = registry.counter("tyf_bytes_sent_total", "发出的字节数", ("type", "format"))
+messages_dropped = registry.counter("tyf_messages_dropped_total", "发送队列已满被丢弃的消息数", ("type",))
+draw_points = registry.counter("tyf_draw_points_total", "收到的绘制点数，以及简化后实际绘制的点数", ("stage",))
+update_canvas_seconds = registry.histogram("tyf_update_canvas_seconds", "处理一个绘制点的耗时")
+encode_seconds = registry.histogram("tyf_encode_seconds", "画布编码（cv2.imencode等）的耗时", ("format",))
+broadcast_seconds = registry.histogram("tyf_broadcast_seconds", "一次广播放入所有连接发送队列的耗时", ("type",))
+connection_lifetime_seconds = registry.histogram(
+    "tyf_connection_lifetime_seconds", "连接从建立到断开的时长", buckets=(1, 10, 60, 300, 900, 1800, 3600, 7200, 21600)
+)
+connections_evicted = registry.counter("tyf_connections_evicted_total", "因心跳超时、长时间空闲、消息刷屏、发送失败或发送队列溢出被断开的连接数", ("reason",))
+heartbeat_rtt_seconds = registry.histogram("tyf_heartbeat_rtt_seconds", "心跳往返时间（含发送队列排队）")
+ai_guesses = registry.counter("tyf_ai_guesses_total", "AI猜词请求数，按结果来源（缓存、共享进行中的请求、视觉模型）", ("source",))
+rate_limited = registry.counter(
+    "tyf_rate_limited_total", "超出限流的客户端消息数（绘制为去掉的点数），按类型和处理方式", ("type", "action")
+)
+timelapse_jobs = registry.counter("tyf_timelapse_jobs_total", "延时回放渲染任务数，按结果", ("result",))
+send_queue_depth = registry.histogram(
+    "tyf_send_queue_depth", "消息入队时该连接发送队列的长度", buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128)
+)
@@ -1,86 +1,489 @@
 import cv2
-import mediapipe as mp
 import numpy as np
-import random
 import time
-import requests
 import base64
+import binascii
 import json
-from PIL import ImageFont, ImageDraw, Image
-import uvicorn
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse, Response
+from starlette.requests import HTTPConnection
 import os
 import socket
+import asyncio
+import struct
+import secrets
+from collections import deque, OrderedDict
+from tyf_backplane import create_backplane
+from tyf_encoder import canvas_encoder, encode_tiles, VersionedEncodeCache
+from tyf_canvas import create_canvas
+from tyf_match import CORRECT, WRONG, matcher_for
+from tyf_words import WordDeck, default_word_bank
+import tyf_metrics as metrics
+from tyf_http import CompressedBody, etag_matches
+from tyf_strokelog import StrokeLog, DRAWINGS_DIR, replay
+from tyf_simplify import StrokeSimplifier, STROKE_SIMPLIFY_TOLERANCE
+from tyf_guesser import create_guesser_service
+from tyf_timelapse import timelapse_renderer
+from tyf_ratelimit import RateLimiter
 
-# 创建保存目录
-save_dir = "drawings"
-if not os.path.exists(save_dir):
-    os.makedirs(save_dir)
+# 画布广播频率（次/秒），每个周期最多向猜词者发送一条画布更新
+CANVAS_TICK_RATE = float(os.environ.get("CANVAS_TICK_RATE", 30))
+# 每个连接发送队列的最大长度，慢速客户端积压超过此长度时丢弃最旧的消息
+SEND_QUEUE_SIZE = int(os.environ.get("SEND_QUEUE_SIZE", 64))
+# 画布存储方式：bgr 为3通道数组，palette 为调色板下标（内存约三分之一）
+CANVAS_BACKEND = os.environ.get("CANVAS_BACKEND", "bgr")
+# 画布分块边长，定期关键帧只编码被修改过的分块
+TILE_SIZE = 64
+# 被修改的分块超过此比例时直接发送完整画面
+FULL_FRAME_TILE_RATIO = 0.5
+# 每局保存的画布增量条数上限，写满时生成新的关键帧并清空
+DELTA_LOG_SIZE = 256
+# 服务器发送心跳的间隔（秒），客户端收到ping后回复pong
+HEARTBEAT_INTERVAL = float(os.environ.get("HEARTBEAT_INTERVAL", 15))
+# 超过此时长（秒）没有收到客户端的任何消息（包括pong）时认为连接已断开
+HEARTBEAT_TIMEOUT = float(os.environ.get("HEARTBEAT_TIMEOUT", 45))
+# 超过此时长（秒）只回复心跳、没有其他消息时断开空闲连接，0为不限制
+IDLE_TIMEOUT = float(os.environ.get("IDLE_TIMEOUT", 1800))
+# 每局保留的猜测记录条数（环形缓冲区）
+GUESS_HISTORY_SIZE = 50
+# 画布缩略图的默认宽度和允许范围，宽度按16像素取整以限制缓存的种类
+THUMBNAIL_WIDTH = 160
+THUMBNAIL_MIN_WIDTH = 16
+THUMBNAIL_MAX_WIDTH = 640
+# 每个房间保留的断线重连会话数
+MAX_SESSIONS_PER_ROOM = 256
+
+# 二进制协议：客户端在register消息中带上 "binary": true 协商开启
+# 服务器发出的二进制帧以帧头开始：帧类型（1字节）和画布序号（4字节），其后为数据（小端序）
+# 客户端发出的二进制帧只有1字节的帧类型
+FRAME_KEYFRAME = 0x01  # 服务器 -> 客户端：原始JPEG数据
+FRAME_STROKE = 0x02  # 服务器 -> 客户端：若干线段记录
+FRAME_TILES = 0x03  # 服务器 -> 客户端：若干分块记录
+FRAME_DRAW = 0x10  # 客户端 -> 服务器：若干绘制点记录
+# 线段记录：起点x, 起点y, 终点x, 终点y, 颜色B, G, R, 粗细
+SEGMENT_STRUCT = struct.Struct("<hhhhBBBB")
+# 绘制点记录：x, y, 标志位（bit0为drawing，bit1表示带颜色）, 颜色B, G, R
+POINT_STRUCT = struct.Struct("<hhBBBB")
+FRAME_HEADER_STRUCT = struct.Struct("<BI")
+# 分块记录头：左上角x, y, JPEG数据长度，其后紧跟JPEG数据
+TILE_HEADER_STRUCT = struct.Struct("<hhI")
+POINT_DRAWING = 0x01
+POINT_HAS_COLOR = 0x02
+# 线段记录中坐标的范围（有符号16位），客户端发来的坐标截断到此范围
+COORD_MIN = -32768
+COORD_MAX = 32767
+
+# 画布消息：发送队列已满时可以丢弃最旧的一条，之后补发完整画面即可恢复；其他消息丢失后无法恢复
+CANVAS_FRAME_TYPES = ("canvas_update", "canvas_tiles", "stroke")
+
+# 客户端可以发送的JSON消息类型，其他类型在指标中记为other
+CLIENT_MESSAGE_TYPES = ("register", "draw", "draw_batch", "clear", "canvas_update", "guess", "reset", "pong", "ai_guess")
+
+def pack_segments(segments):
+    """将线段列表打包为二进制数据"""
+    return b"".join(
+        SEGMENT_STRUCT.pack(*segment["from"], *segment["to"], *segment["color"], segment["thickness"])
+        for segment in segments
+    )
+
+def pack_tiles(tiles):
+    """将分块列表打包为二进制数据"""
+    return b"".join(
+        TILE_HEADER_STRUCT.pack(tile["x"], tile["y"], len(tile["image"])) + tile["image"]
+        for tile in tiles
+    )
+
+def unpack_points(data):
+    """解析客户端发送的绘制点二进制帧，返回 (x, y, drawing, color) 列表"""
+    if not data or data[0] != FRAME_DRAW:
+        return []
+    body = data[1:len(data) - (len(data) - 1) % POINT_STRUCT.size]
+    points = []
+    for x, y, flags, b, g, r in POINT_STRUCT.iter_unpack(body):
+        color = (b, g, r) if flags & POINT_HAS_COLOR else None
+        points.append((x, y, bool(flags & POINT_DRAWING), color))
+    return points
+
+def clamp_coord(value):
+    return min(max(int(value), COORD_MIN), COORD_MAX)
+
+def clamp_color(color):
+    """把颜色截断为3个0~255的整数，格式有误时返回None"""
+    try:
+        b, g, r = (min(max(int(c), 0), 255) for c in color)
+    except (TypeError, ValueError):
+        return None
+    return (b, g, r)
+
+def read_point(point):
+    """从JSON消息中读取一个绘制点 (x, y, drawing, color)，坐标截断到线段记录的范围"""
+    return (clamp_coord(point["x"]), clamp_coord(point["y"]), bool(point["drawing"]), point.get("color", None))
+
+def decode_canvas_upload(canvas_data):
+    """解码客户端上传的base64图片，数据有误时返回None"""
+    try:
+        return base64.b64decode(canvas_data, validate=True)
+    except (binascii.Error, TypeError, ValueError):
+        return None
 
 # 游戏状态
 class GameState:
-    def __init__(self):
-        # 游戏词库
-        self.words = [
-            "苹果", "香蕉", "猫", "狗", "房子", "汽车", "飞机", "船", "树", "花",
-            "太阳", "月亮", "星星", "雨伞", "眼镜", "帽子", "鞋子", "衣服", "手机", "电脑",
-            "电视", "冰箱", "洗衣机", "自行车", "摩托车", "火车", "火箭", "足球", "篮球", "乒乓球"
-        ]
+    def __init__(self, deck=None, stroke_log=None):
+        # 游戏词库：每个房间一副洗好的牌，发完之前不会重复
+        self.deck = deck if deck is not None else WordDeck(default_word_bank())
+        # 猜词匹配索引，同一词库的房间共用
+        self.matcher = matcher_for(self.deck.bank)
         self.current_word = self.get_random_word()
-        self.canvas = np.ones((480, 640, 3), dtype=np.uint8) * 255
+        # 笔画日志，为None时不记录
+        self.stroke_log = stroke_log
+        self.board = create_canvas(CANVAS_BACKEND)
         self.drawing = False
         self.last_x, self.last_y = 0, 0
         self.ai_guess = ""
         self.hint = ""
-        self.guesses = []  # 存储所有猜测
+        self.guesses = deque(maxlen=GUESS_HISTORY_SIZE)  # 最近的猜测记录
+        self.guess_seq = 0  # 猜测序号，客户端据此判断是否漏收
         self.is_game_active = True
         self.current_color = (0, 0, 0)  # 默认颜色：黑色 (BGR格式)
+        self.thickness = 2  # 线条粗细
+        # 增量广播：猜词者在本地按线段重绘，每隔若干线段补发一次完整画面作为关键帧
+        self.keyframe_interval = 200
+        self.segments_since_keyframe = 0
+        # 按周期合并广播：两次刷新之间的变化先累积在这里
+        self.dirty = False
+        self.pending_segments = []
+        self.keyframe_pending = False
+        # 自上次关键帧以来被线段修改过的分块
+        self.tile_size = TILE_SIZE
+        self.dirty_tiles = np.zeros((-(-480 // TILE_SIZE), -(-640 // TILE_SIZE)), dtype=bool)
+        # 画布消息序号，以及供新加入和重连的客户端补发的关键帧和其后的增量
+        self.seq = 0
+        self.keyframe_seq = 0
+        self.keyframe_image = None  # None表示空白画布
+        self.delta_log = deque()
+        # 画布版本号，每次修改画布时递增；编码在线程池中进行，同一版本只编码一次
+        self.version = 0
+        self.round = 0
+        self.encode_cache = VersionedEncodeCache(canvas_encoder)
+        # 笔画日志的写入按顺序进行，同一时间只有一批
+        self.stroke_log_lock = asyncio.Lock()
+    
+    async def recover_round(self):
+        """回放进程崩溃前进行中的一局；没有时开始记录新的一局
+        
+        回放在线程池中绘制到新的画布上，完成后再替换，房间创建时调用。
+        """
+        if self.stroke_log is None:
+            return
+        try:
+            path = await canvas_encoder.submit(self.stroke_log.recover)
+            if path is not None:
+                board = create_canvas(CANVAS_BACKEND)
+                word = await canvas_encoder.submit(replay, path, board)
+                self.board = board
+                self.current_word = word
+                self.version += 1
+                self.request_keyframe()
+                return
+        except Exception as e:
+            print(f"恢复笔画日志失败: {e}")
+        self.stroke_log.start_round(self.current_word)
+    
+    @property
+    def canvas(self):
+        """BGR格式的画布"""
+        return self.board.to_bgr()
     
     def get_random_word(self):
         """获取随机词语"""
-        return random.choice(self.words)
+        return self.deck.draw()
     
-    def reset_game(self):
-        """重置游戏"""
-        self.current_word = self.get_random_word()
-        self.canvas = np.ones((480, 640, 3), dtype=np.uint8) * 255
+    def reset_game(self, word=None):
+        """重置游戏，可指定新词（例如由其他工作进程选定）"""
+        self.current_word = word if word is not None else self.get_random_word()
+        if self.stroke_log is not None:
+            self.stroke_log.start_round(self.current_word)
+        self.board.clear()
         self.drawing = False
         self.last_x, self.last_y = 0, 0
         self.ai_guess = ""
         self.hint = ""
-        self.guesses = []
+        self.guesses.clear()
         self.is_game_active = True
+        self.segments_since_keyframe = 0
+        # 重置后客户端会自行清空画布，丢弃尚未发送的旧增量
+        self.dirty = False
+        self.pending_segments = []
+        self.keyframe_pending = False
+        self.dirty_tiles[:] = False
+        self.version += 1
+        self.round += 1
+        # 新的一局从空白画布开始
+        self.seq += 1
+        self.set_keyframe(self.seq, None)
     
     def add_guess(self, guess):
-        """添加猜测"""
-        self.guesses.append(guess)
-        return self.check_guess(guess)
+        """添加猜测，返回猜测记录 {"guess", "is_correct", "match", "guess_seq"}"""
+        match = self.match_guess(guess)
+        return self.record_guess(guess, match == CORRECT, match=match)
+    
+    def record_guess(self, guess, is_correct, guess_seq=None, match=None):
+        """记录一次猜测；guess_seq由其他工作进程给出时沿用其序号"""
+        self.guess_seq = max(self.guess_seq + 1, guess_seq or 0)
+        if match is None:
+            match = CORRECT if is_correct else WRONG
+        record = {"guess": guess, "is_correct": is_correct, "match": match, "guess_seq": self.guess_seq}
+        self.guesses.append(record)
+        return record
+    
+    def match_guess(self, guess):
+        """判断猜测与当前词语的关系：correct、close 或 wrong"""
+        return self.matcher.match(guess, self.current_word)
     
     def check_guess(self, guess):
         """检查猜测是否正确"""
-        return guess == self.current_word
+        return self.match_guess(guess) == CORRECT
     
     def update_canvas(self, x, y, drawing, color=None):
-        """更新画布，支持自定义颜色"""
+        """更新画布，支持自定义颜色；返回本次绘制的线段，未绘制时返回None"""
         # 如果提供了颜色，更新当前颜色
         if color is not None:
-            self.current_color = tuple(color)  # 转换为元组
+            # 颜色和粗细都会按字节写入线段记录，先截断到有效范围，格式有误的颜色被忽略
+            self.current_color = clamp_color(color) or self.current_color
         
+        start = time.perf_counter()
+        x, y = clamp_coord(x), clamp_coord(y)
+        segment = None
         if drawing:
             if self.last_x != 0 and self.last_y != 0:
                 # 使用当前颜色绘制线条
-                cv2.line(self.canvas, (self.last_x, self.last_y), (x, y), self.current_color, 2)
+                segment = {
+                    "from": [self.last_x, self.last_y],
+                    "to": [x, y],
+                    "color": list(self.current_color),
+                    "thickness": min(max(int(self.thickness), 1), 255)
+                }
+                self.apply_segment(segment)
             self.last_x, self.last_y = x, y
         else:
             self.last_x, self.last_y = 0, 0
+        metrics.update_canvas_seconds.observe(value=time.perf_counter() - start)
+        return segment
+    
+    def update_canvas_batch(self, points):
+        """按顺序应用一批绘制点，每个点为 (x, y, drawing, color)；返回产生的线段列表"""
+        segments = []
+        for x, y, drawing, color in points:
+            segment = self.update_canvas(x, y, drawing, color)
+            if segment is not None:
+                segments.append(segment)
+        return segments
+    
+    def apply_segment(self, segment, log=True):
+        """在画布上绘制一条线段，并加入待广播的增量；其他工作进程的线段由它自己记录，log为False"""
+        self.board.draw_line(tuple(segment["from"]), tuple(segment["to"]), tuple(segment["color"]), segment["thickness"])
+        if log and self.stroke_log is not None:
+            self.stroke_log.segment(segment)
+        self.mark_dirty_tiles(segment)
+        self.version += 1
+        self.segments_since_keyframe += 1
+        self.pending_segments.append(segment)
+        self.dirty = True
+    
+    def mark_dirty_tiles(self, segment):
+        """标记线段包围盒覆盖到的分块"""
+        radius = segment["thickness"]
+        (x0, y0), (x1, y1) = segment["from"], segment["to"]
+        left = max(min(x0, x1) - radius, 0) // self.tile_size
+        right = max(max(x0, x1) + radius, 0) // self.tile_size
+        top = max(min(y0, y1) - radius, 0) // self.tile_size
+        bottom = max(max(y0, y1) + radius, 0) // self.tile_size
+        self.dirty_tiles[top:bottom + 1, left:right + 1] = True
+    
+    def clear_canvas(self, log=True):
+        """清空画布；其他工作进程的清空操作由它自己记录，log为False"""
+        self.board.clear()
+        if log and self.stroke_log is not None:
+            self.stroke_log.clear()
+        self.dirty_tiles[:] = False
+        self.version += 1
+        self.segments_since_keyframe = 0
+        self.pending_segments = []
+        self.keyframe_pending = True
+        self.dirty = True
+    
+    def needs_keyframe(self):
+        """距离上次关键帧的线段数是否已达到间隔"""
+        return self.segments_since_keyframe >= self.keyframe_interval
+    
+    def encode_canvas(self, ext='.jpg'):
+        """在线程池中编码当前版本的完整画布，返回可等待对象"""
+        return self.encode_cache.get(self.version, self.board, ext)
+    
+    def encode_thumbnail(self, width, ext='.jpg'):
+        """在线程池中编码当前版本的画布缩略图，返回可等待对象"""
+        return self.encode_cache.get_thumbnail(self.version, self.board, width, ext)
+    
+    def encode_keyframe(self):
+        """编码关键帧，并重置线段计数和脏块"""
+        self.segments_since_keyframe = 0
+        self.dirty_tiles[:] = False
+        return self.encode_canvas()
     
-    def clear_canvas(self):
-        """清空画布"""
-        self.canvas = np.ones((480, 640, 3), dtype=np.uint8) * 255
+    def encode_dirty_tiles(self):
+        """在线程池中只编码自上次关键帧以来被修改过的分块，结果为 [{"x", "y", "image"}]"""
+        tiles = []
+        size = self.tile_size
+        for row, col in zip(*np.nonzero(self.dirty_tiles)):
+            x, y = int(col) * size, int(row) * size
+            tiles.append((x, y, self.board.snapshot(x, y, size, size)))
+        self.segments_since_keyframe = 0
+        self.dirty_tiles[:] = False
+        return canvas_encoder.submit(encode_tiles, self.board.encode, tiles)
+    
+    async def snapshot(self):
+        """导出当前局的状态，画布使用无损PNG，供其他工作进程同步"""
+        state = {
+            "current_word": self.current_word,
+            "guesses": list(self.guesses)
+        }
+        state["canvas"] = base64.b64encode(await self.encode_canvas('.png')).decode('utf-8')
+        return state
+    
+    async def restore(self, snapshot):
+        """从其他工作进程导出的状态恢复"""
+        image = base64.b64decode(snapshot["canvas"])
+        # 解码和量化（调色板画布）都在线程池中进行
+        canvas = await canvas_encoder.submit(decode_canvas, image, self.board.quantizer())
+        self.reset_game(snapshot["current_word"])
+        if self.stroke_log is not None:
+            # 同步得到的画面作为本节点这一局的起点，之后只记录本节点产生的操作
+            self.stroke_log.image(image)
+        for record in snapshot["guesses"]:
+            self.record_guess(record["guess"], record["is_correct"], record["guess_seq"], record.get("match"))
+        self.board.load_quantized(canvas)
+        self.version += 1
+        self.request_keyframe()
+    
+    async def flush_stroke_log(self, force=False):
+        """在线程池中批量写入笔画日志，已结束的各局交给进程池渲染延时回放
+        
+        写入在独立的任务中进行，调用方（例如广播任务）被取消时这一批仍会写完并提交渲染。
+        """
+        if self.stroke_log is None or not (force or self.stroke_log.due()):
+            return
+        await asyncio.shield(self.write_stroke_log())
+    
+    async def write_stroke_log(self):
+        # 取出和写入都在锁内进行，各批按取出的顺序写入同一个文件
+        async with self.stroke_log_lock:
+            operations = self.stroke_log.take_batch()
+            if not operations:
+                return
+            try:
+                finished = await canvas_encoder.submit(self.stroke_log.write_batch, operations)
+            except Exception as e:
+                print(f"写入笔画日志失败: {e}")
+                return
+        for path in finished:
+            timelapse_renderer.submit(path)
+    
+    def request_keyframe(self):
+        """要求下个周期发送完整画面（例如有客户端丢失了线段增量）"""
+        self.keyframe_pending = True
+        self.dirty = True
+    
+    async def take_canvas_update(self):
+        """取出自上次刷新以来的画布变化并合并为一条消息，没有变化时返回None
+        
+        需要编码的画面在第一次await之前就已复制，等待编码期间新到的线段留到下个周期。
+        """
+        if not self.dirty:
+            return None
+        round_id = self.round
+        self.seq += 1
+        keyframe = None  # 同时保存为补发用关键帧的编码结果
+        tiles = None
+        if self.keyframe_pending or (self.needs_keyframe() and self.dirty_tiles.mean() > FULL_FRAME_TILE_RATIO):
+            # 清空画布、客户端需要重新同步或大部分区域都有变化时发送完整画面
+            message = {"type": "canvas_update"}
+            keyframe = self.encode_keyframe()
+        elif self.needs_keyframe():
+            # 定期只发送变化过的分块，纠正客户端本地重绘的误差
+            message = {"type": "canvas_tiles"}
+            tiles = self.encode_dirty_tiles()
+        else:
+            # 只广播线段增量，由猜词者在本地绘制
+            message = {"type": "stroke", "segments": self.pending_segments}
+            if len(self.delta_log) >= DELTA_LOG_SIZE:
+                # 增量记录已满，以当前画面生成新的关键帧
+                keyframe = self.encode_canvas()
+        message["seq"] = self.seq
+        self.dirty = False
+        self.pending_segments = []
+        self.keyframe_pending = False
+        if tiles is not None:
+            message["tiles"] = await tiles
+        if keyframe is not None:
+            keyframe = await keyframe
+        if self.round != round_id:
+            # 等待编码期间游戏已重置，旧画面不再发送
+            return None
+        if message["type"] == "canvas_update":
+            message["image"] = keyframe
+        self.record_canvas_message(message, keyframe)
+        return message
+    
+    def set_keyframe(self, seq, image):
+        """保存关键帧，并清空增量记录"""
+        self.keyframe_seq = seq
+        self.keyframe_image = image
+        self.delta_log.clear()
+    
+    def record_canvas_message(self, message, keyframe=None):
+        """记录已广播的画布消息；带有关键帧时以它替换之前的记录"""
+        if keyframe is not None:
+            self.set_keyframe(message["seq"], keyframe)
+        else:
+            self.delta_log.append(message)
+    
+    def catch_up(self, last_seq=None):
+        """返回客户端需要补发的画布消息；last_seq之后的增量都还在记录中时只补发增量
+        
+        连续的线段增量合并为一条，补发的消息数不会超过发送队列的长度。
+        """
+        if last_seq is not None and self.keyframe_seq <= last_seq <= self.seq:
+            return merge_strokes(message for message in self.delta_log if message["seq"] > last_seq)
+        keyframe = {
+            "type": "canvas_update",
+            "seq": self.keyframe_seq,
+            "image": self.keyframe_image if self.keyframe_image is not None else encode_blank_canvas()
+        }
+        return [keyframe] + merge_strokes(self.delta_log)
+
+def merge_strokes(messages):
+    """把连续的线段增量合并为一条消息，序号取最后一条的"""
+    merged = []
+    for message in messages:
+        if message["type"] == "stroke" and merged and merged[-1]["type"] == "stroke":
+            merged[-1] = {"type": "stroke", "segments": merged[-1]["segments"] + message["segments"], "seq": message["seq"]}
+        else:
+            merged.append(message)
+    return merged
 
-# 创建游戏状态实例
-game_state = GameState()
+def decode_canvas(image, quantize):
+    """解码图片并转换为画布数据，在线程池中调用"""
+    return quantize(cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR))
+
+# 空白画布的JPEG数据，所有房间共用
+blank_canvas_image = None
+
+def encode_blank_canvas():
+    global blank_canvas_image
+    if blank_canvas_image is None:
+        blank_canvas_image = cv2.imencode('.jpg', np.ones((480, 640, 3), dtype=np.uint8) * 255)[1].tobytes()
+    return blank_canvas_image
 
 # 创建FastAPI应用
 app = FastAPI(title="双人你画我猜游戏")
@@ -96,150 +499,836 @@ app.add_middleware(
     allow_headers=["*"],  # 允许所有HTTP头
 )
 
+# JSON编解码器
+class JsonCodec:
+    """标准库实现的JSON编解码器"""
+    def dumps(self, obj) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    
+    def loads(self, data):
+        return json.loads(data)
+
+class OrjsonCodec(JsonCodec):
+    """基于orjson的快速JSON编解码器"""
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+    
+    def dumps(self, obj) -> str:
+        return self.orjson.dumps(obj).decode('utf-8')
+    
+    def loads(self, data):
+        return self.orjson.loads(data)
+
+def default_json_codec():
+    """安装了orjson时使用orjson，否则使用标准库"""
+    try:
+        return OrjsonCodec()
+    except ImportError:
+        return JsonCodec()
+
+json_codec = default_json_codec()
+
+def set_json_codec(codec):
+    """替换全局使用的JSON编解码器"""
+    global json_codec
+    json_codec = codec
+
+def image_to_base64(message: dict):
+    """把消息（及其分块）中的原始图片数据 "image" 转为base64字段 "canvas"，供JSON格式使用"""
+    if "image" in message:
+        message = dict(message)
+        message["canvas"] = base64.b64encode(message.pop("image")).decode('utf-8')
+    if "tiles" in message:
+        message = dict(message)
+        message["tiles"] = [image_to_base64(tile) for tile in message["tiles"]]
+    return message
+
+# 序列化后的消息
+class WireFrame:
+    """广播时每条消息只序列化一次，所有连接共享同一份数据
+    
+    画布消息可以用 "image" 携带原始JPEG数据，只有文本格式需要时才转为base64。
+    """
+    __slots__ = ("type", "message", "_text", "_text_size", "_binary")
+    
+    def __init__(self, message: dict):
+        self.type = message["type"]
+        self.message = message
+        self._text = None
+        self._text_size = None
+        self._binary = None
+    
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = json_codec.dumps(image_to_base64(self.message))
+        return self._text
+    
+    @property
+    def text_size(self):
+        """文本格式的UTF-8字节数"""
+        if self._text_size is None:
+            self._text_size = len(self.text.encode('utf-8'))
+        return self._text_size
+    
+    @property
+    def binary(self):
+        """二进制帧，没有二进制格式的消息返回None"""
+        if self._binary is None:
+            if self.type == "canvas_update":
+                image = self.message.get("image")
+                if image is None:
+                    image = base64.b64decode(self.message["canvas"])
+                self._binary = self.header(FRAME_KEYFRAME) + image
+            elif self.type == "stroke":
+                self._binary = self.header(FRAME_STROKE) + pack_segments(self.message["segments"])
+            elif self.type == "canvas_tiles":
+                self._binary = self.header(FRAME_TILES) + pack_tiles(self.message["tiles"])
+        return self._binary
+    
+    def header(self, frame_type):
+        return FRAME_HEADER_STRUCT.pack(frame_type, self.message.get("seq", 0))
+    
+    def prepare(self, text=True, binary=False):
+        """在放入发送队列之前完成序列化，出错时由调用方丢弃这条消息，不会影响各连接的写任务"""
+        if binary and self.binary is None:
+            # 没有二进制格式的消息以文本发送
+            text = True
+        if text:
+            self.text
+
+# 单个客户端连接
+class ClientConnection:
+    """为每个WebSocket维护有界发送队列，由独立的写任务负责发送，慢速客户端不会阻塞其他人"""
+    def __init__(self, websocket: WebSocket, max_queue=SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.queue = deque()
+        self.max_queue = max_queue
+        self.wakeup = asyncio.Event()
+        self.writer_task = None
+        self.closed = False
+        self.dropped = 0  # 因队列已满被丢弃的消息数
+        self.canvas_stale = False  # 丢失过线段增量，需要补发完整画面
+        self.binary = False  # 是否协商使用二进制协议
+        # 连接建立、最后收到任何消息、最后收到心跳以外消息的时间
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+        self.last_active = self.connected_at
+        self.rtt = None  # 最近一次心跳往返时间（秒）
+        self.limiter = RateLimiter()  # 按消息类型限流，注册角色后使用该角色的限额
+    
+    def start(self):
+        """启动写任务"""
+        self.writer_task = asyncio.create_task(self.writer_loop())
+    
+    def close(self):
+        """停止写任务"""
+        self.closed = True
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+    
+    def touch(self, active=True):
+        """收到客户端消息时调用，心跳回复不计为活跃"""
+        self.last_seen = time.monotonic()
+        if active:
+            self.last_active = self.last_seen
+    
+    def expired(self, now):
+        """返回应断开连接的原因（timeout或idle），否则返回None"""
+        if now - self.last_seen > HEARTBEAT_TIMEOUT:
+            return "timeout"
+        if IDLE_TIMEOUT and now - self.last_active > IDLE_TIMEOUT:
+            return "idle"
+        return None
+    
+    def ping(self):
+        """发送心跳，t为服务器时间（毫秒），客户端原样带回"""
+        self.send({"type": "ping", "t": int(time.monotonic() * 1000)})
+    
+    def pong(self, data):
+        """处理心跳回复"""
+        sent = data.get("t")
+        if isinstance(sent, (int, float)):
+            self.rtt = max(time.monotonic() - sent / 1000, 0)
+            metrics.heartbeat_rtt_seconds.observe(value=self.rtt)
+    
+    def send(self, message: dict):
+        """将消息放入发送队列，不等待实际发送"""
+        frame = WireFrame(message)
+        try:
+            frame.prepare(text=not self.binary, binary=self.binary)
+        except Exception as e:
+            print(f"消息序列化失败: {e}")
+            return
+        self.send_frame(frame)
+    
+    def send_frame(self, frame: WireFrame):
+        """将已序列化的消息放入发送队列
+        
+        队列已满时丢弃最旧的画布消息，由广播任务之后补发完整画面；
+        队列中全是其他消息（猜测结果、游戏重置等）时说明客户端已经跟不上，断开连接。
+        """
+        if self.closed:
+            return
+        if frame.type == "canvas_update":
+            # 完整画面包含之前所有的画布变化，队列中尚未发送的旧画布消息直接替换掉
+            self.queue = deque(f for f in self.queue if f.type not in CANVAS_FRAME_TYPES)
+            self.canvas_stale = False
+        while len(self.queue) >= self.max_queue:
+            index = next((i for i, f in enumerate(self.queue) if f.type in CANVAS_FRAME_TYPES), None)
+            if index is None:
+                if frame.type in CANVAS_FRAME_TYPES:
+                    # 没有可以替换的画布消息，丢弃新的画布消息
+                    self.drop(frame)
+                    return
+                self.fail("overflow")
+                return
+            dropped = self.queue[index]
+            del self.queue[index]
+            self.drop(dropped)
+        metrics.send_queue_depth.observe(value=len(self.queue))
+        self.queue.append(frame)
+        self.wakeup.set()
+    
+    def drop(self, frame: WireFrame):
+        """丢弃一条画布消息，之后需要补发完整画面"""
+        self.dropped += 1
+        metrics.messages_dropped.inc(frame.type)
+        self.canvas_stale = True
+    
+    def fail(self, reason):
+        """发送失败或无法继续发送时关闭连接；接收循环随之结束，没有结束时由心跳任务从房间中移除"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        metrics.connections_evicted.inc(reason)
+        asyncio.create_task(close_websocket(self.websocket, 1011))
+    
+    async def writer_loop(self):
+        """依次发送队列中的消息"""
+        try:
+            while True:
+                while not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                frame = self.queue.popleft()
+                data = frame.binary if self.binary else None
+                if data is not None:
+                    await self.websocket.send_bytes(data)
+                    metrics.messages_sent.inc(frame.type, "binary")
+                    metrics.bytes_sent.inc(frame.type, "binary", amount=len(data))
+                else:
+                    await self.websocket.send_text(frame.text)
+                    metrics.messages_sent.inc(frame.type, "text")
+                    metrics.bytes_sent.inc(frame.type, "text", amount=frame.text_size)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 发送失败说明连接已断开或消息有误，关闭连接
+            print(f"发送消息失败: {e}")
+            self.fail("send_failed")
+
 # 创建WebSocket连接管理器
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: list[WebSocket] = []
-        self.drawers: list[WebSocket] = []  # 画画的人
-        self.guessers: list[WebSocket] = []  # 猜词的人
+        self.active_connections: dict[WebSocket, ClientConnection] = {}
+        self.drawers: dict[WebSocket, ClientConnection] = {}  # 画画的人
+        self.guessers: dict[WebSocket, ClientConnection] = {}  # 猜词的人
     
     async def connect(self, websocket: WebSocket):
+        # 先登记再等待握手完成，避免房间在握手期间被判定为空而销毁
+        connection = ClientConnection(websocket)
+        self.active_connections[websocket] = connection
         await websocket.accept()
-        self.active_connections.append(websocket)
+        connection.start()
+        return connection
     
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        if websocket in self.drawers:
-            self.drawers.remove(websocket)
-        if websocket in self.guessers:
-            self.guessers.remove(websocket)
+        connection = self.active_connections.pop(websocket, None)
+        if connection is not None:
+            connection.close()
+            metrics.connection_lifetime_seconds.observe(value=time.monotonic() - connection.connected_at)
+        self.drawers.pop(websocket, None)
+        self.guessers.pop(websocket, None)
     
     async def broadcast(self, message: dict):
         """向所有连接的客户端广播消息"""
-        for connection in self.active_connections:
-            await connection.send_json(message)
+        self.fan_out(self.active_connections.values(), message)
     
     async def broadcast_to_guessers(self, message: dict):
         """向所有猜词的人广播消息"""
-        for connection in self.guessers:
-            await connection.send_json(message)
+        self.fan_out(self.guessers.values(), message)
     
     async def broadcast_to_drawers(self, message: dict):
         """向所有画画的人广播消息"""
-        for connection in self.drawers:
-            await connection.send_json(message)
+        self.fan_out(self.drawers.values(), message)
+    
+    def fan_out(self, connections, message: dict):
+        """序列化一次后放入各连接的发送队列；序列化失败时丢弃这条消息"""
+        frame = WireFrame(message)
+        with metrics.broadcast_seconds.time(frame.type):
+            connections = list(connections)
+            try:
+                frame.prepare(
+                    text=any(not connection.binary for connection in connections),
+                    binary=any(connection.binary for connection in connections)
+                )
+            except Exception as e:
+                print(f"消息序列化失败: {e}")
+                return
+            for connection in connections:
+                connection.send_frame(frame)
+    
+    def stale_guessers(self):
+        """丢失过画布消息、需要补发完整画面的猜词者"""
+        return [connection for connection in self.guessers.values() if connection.canvas_stale]
     
     def add_drawer(self, websocket: WebSocket):
         """添加画画的人"""
-        if websocket not in self.drawers:
-            self.drawers.append(websocket)
-        if websocket in self.guessers:
-            self.guessers.remove(websocket)
+        self.drawers[websocket] = self.active_connections[websocket]
+        self.guessers.pop(websocket, None)
     
     def add_guesser(self, websocket: WebSocket):
         """添加猜词的人"""
-        if websocket not in self.guessers:
-            self.guessers.append(websocket)
-        if websocket in self.drawers:
-            self.drawers.remove(websocket)
+        self.guessers[websocket] = self.active_connections[websocket]
+        self.drawers.pop(websocket, None)
 
-# 创建连接管理器实例
-manager = ConnectionManager()
+# 游戏房间
+class Room:
+    """一个独立的游戏房间，拥有自己的游戏状态、连接和画布广播任务
+    
+    本地产生的游戏事件通过消息总线发布给其他工作进程中的同一房间，
+    收到的远程事件在本地重放并广播给本进程的客户端。
+    """
+    def __init__(self, room_id, backplane, category=None, difficulty=None, simplify_tolerance=STROKE_SIMPLIFY_TOLERANCE):
+        self.room_id = room_id
+        # 房间实例标识，房间销毁后重新创建时画布版本号从头开始，ETag仍然不会重复
+        self.instance = secrets.token_hex(4)
+        # 房间可以限定词语的类别和难度；设置了保存目录时记录每局的笔画
+        self.game_state = GameState(
+            WordDeck(default_word_bank(), category, difficulty),
+            StrokeLog(room_id, node=backplane.node_name) if DRAWINGS_DIR else None
+        )
+        self.manager = ConnectionManager()
+        self.backplane = backplane
+        self.broadcast_task = None
+        self.outbound_segments = []  # 尚未发布到消息总线的本地线段
+        # 本地绘制点先经过笔画简化，容差为0时原样通过
+        self.simplifier = StrokeSimplifier(simplify_tolerance)
+        self.synced = False  # 是否已从其他工作进程同步过状态
+        # 断线重连会话：令牌 -> 角色，只保留最近使用的若干个
+        self.sessions = OrderedDict()
+        self.ready = None  # 恢复上次进行中一局的任务
+    
+    def start(self):
+        """启动画布广播任务并订阅消息总线"""
+        if self.ready is None:
+            self.ready = asyncio.create_task(self.game_state.recover_round())
+        if self.broadcast_task is None or self.broadcast_task.done():
+            self.broadcast_task = asyncio.create_task(self.canvas_broadcast_loop())
+    
+    async def wait_ready(self):
+        """等待房间恢复完成，之后才处理客户端消息"""
+        await asyncio.shield(self.ready)
+    
+    def close(self):
+        """停止画布广播任务并取消订阅"""
+        if self.broadcast_task is not None:
+            self.broadcast_task.cancel()
+            self.broadcast_task = None
+        # 写入剩余的笔画，这一局保持进行中，房间再次创建时恢复
+        asyncio.create_task(self.game_state.flush_stroke_log(force=True))
+        self.backplane.unsubscribe(self.room_id)
+    
+    def is_empty(self):
+        return not self.manager.active_connections
+    
+    def resume_session(self, token, role):
+        """令牌有效且角色一致时恢复会话"""
+        if token is None or self.sessions.get(token) != role:
+            return False
+        self.sessions.move_to_end(token)
+        return True
+    
+    def create_session(self, role):
+        """创建新的会话令牌，超过上限时淘汰最久未使用的会话"""
+        token = secrets.token_urlsafe(16)
+        self.sessions[token] = role
+        while len(self.sessions) > MAX_SESSIONS_PER_ROOM:
+            self.sessions.popitem(last=False)
+        return token
+    
+    async def canvas_broadcast_loop(self):
+        """按固定周期刷新画布变化，无论画画的人发送多快，每个周期最多编码和广播一次"""
+        # 先恢复上次进行中的一局，再加入消息总线，远程事件不会作用在恢复之前的画布上
+        await self.wait_ready()
+        self.backplane.subscribe(self.room_id, self.handle_remote_event)
+        # 向其他工作进程请求该房间当前的状态
+        asyncio.create_task(self.backplane.publish(self.room_id, {"op": "sync_request", "node": self.backplane.node_id}))
+        interval = 1 / CANVAS_TICK_RATE
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.tick()
+            except Exception as e:
+                # 一条有问题的记录不能让房间停止广播
+                print(f"刷新画布失败: {e}")
+    
+    async def tick(self):
+        self.drain_strokes()
+        try:
+            await self.flush_segments()
+        except Exception as e:
+            print(f"发布画布增量失败: {e}")
+        await self.game_state.flush_stroke_log()
+        for connection in self.manager.stale_guessers():
+            # 只给丢失过消息的连接补发关键帧和之后的增量
+            for canvas_message in self.game_state.catch_up():
+                connection.send(canvas_message)
+        message = await self.game_state.take_canvas_update()
+        if message is not None:
+            await self.manager.broadcast_to_guessers(message)
+    
+    def draw(self, x, y, drawing, color=None):
+        """处理本地的绘制点，产生的线段在下个周期发布"""
+        self.draw_batch([(x, y, drawing, color)])
+    
+    def draw_batch(self, points):
+        """一次处理一批本地绘制点，先去掉简化后多余的点"""
+        simplified = []
+        for point in points:
+            simplified.extend(self.simplifier.push(point))
+        metrics.draw_points.inc("received", amount=len(points))
+        self.apply_points(simplified)
+    
+    def reset_game(self, word=None):
+        """重置游戏；简化器中缓存的点属于上一局，直接丢弃"""
+        self.simplifier.reset()
+        self.game_state.reset_game(word)
+    
+    def drain_strokes(self):
+        """绘制简化器中缓存的点，在每个周期以及清空画布之前调用"""
+        self.apply_points(self.simplifier.drain())
+    
+    def apply_points(self, points):
+        if points:
+            metrics.draw_points.inc("applied", amount=len(points))
+            self.outbound_segments.extend(self.game_state.update_canvas_batch(points))
+    
+    async def flush_segments(self):
+        """把累积的本地线段合并为一个事件发布"""
+        if self.outbound_segments:
+            segments = self.outbound_segments
+            self.outbound_segments = []
+            await self.backplane.publish(self.room_id, {"op": "segments", "segments": segments})
+    
+    async def publish(self, event):
+        """发布本地事件，先发布之前的线段以保证顺序"""
+        await self.flush_segments()
+        await self.backplane.publish(self.room_id, event)
+    
+    async def announce_guess(self, record):
+        """向所有客户端广播这一次的猜测结果，完整记录只在加入时发送"""
+        await self.manager.broadcast({
+            "type": "guess_result",
+            "guess": record["guess"],
+            "is_correct": record["is_correct"],
+            "match": record["match"],
+            "guess_seq": record["guess_seq"]
+        })
+    
+    async def ai_guess(self, hint=""):
+        """请AI猜测当前画面，结果广播给房间内所有人，不计入猜测记录"""
+        game_state = self.game_state
+        round_id = game_state.round
+        image = await game_state.encode_canvas()
+        guess = await ai_guesser.guess(self.room_id, image, hint)
+        if game_state.round != round_id:
+            # 等待期间游戏已重置
+            return
+        result = {"guess": guess, "is_correct": game_state.check_guess(guess)}
+        await self.announce_ai_guess(result)
+        await self.publish({"op": "ai_guess", **result})
+    
+    async def announce_ai_guess(self, result):
+        await self.manager.broadcast({"type": "ai_guess_result", **result})
+    
+    async def announce_reset(self):
+        """向所有客户端广播游戏重置"""
+        await self.manager.broadcast({
+            "type": "game_reset",
+            "current_word": self.game_state.current_word
+        })
+    
+    async def handle_remote_event(self, event):
+        """重放其他工作进程发布的事件"""
+        op = event["op"]
+        if op == "segments":
+            for segment in event["segments"]:
+                self.game_state.apply_segment(segment, log=False)
+        elif op == "clear":
+            self.game_state.clear_canvas(log=False)
+        elif op == "canvas_upload":
+            image = decode_canvas_upload(event["canvas"])
+            if image:
+                await self.manager.broadcast_to_guessers({
+                    "type": "canvas_update",
+                    "image": image
+                })
+        elif op == "guess":
+            record = self.game_state.record_guess(event["guess"], event["is_correct"], event["guess_seq"], event.get("match"))
+            await self.announce_guess(record)
+        elif op == "ai_guess":
+            await self.announce_ai_guess({"guess": event["guess"], "is_correct": event["is_correct"]})
+        elif op == "reset":
+            self.reset_game(event["current_word"])
+            await self.announce_reset()
+        elif op == "sync_request":
+            await self.publish({"op": "sync_state", "to": event["node"], "state": await self.game_state.snapshot()})
+        elif op == "sync_state":
+            # 只接受发给自己的第一份状态
+            if event["to"] != self.backplane.node_id or self.synced:
+                return
+            self.synced = True
+            self.simplifier.reset()
+            await self.game_state.restore(event["state"])
+            await self.manager.broadcast({
+                "type": "game_state",
+                "current_word": self.game_state.current_word,
+                "is_game_active": self.game_state.is_game_active,
+                "guesses": list(self.game_state.guesses)
+            })
+
+# 房间管理器
+class RoomRegistry:
+    """按房间号查找房间，房间在第一个连接加入时创建，最后一个连接离开时销毁"""
+    def __init__(self, backplane):
+        self.rooms: dict[str, Room] = {}
+        self.backplane = backplane
+        self.heartbeat_task = None
+    
+    def start(self):
+        """启动心跳任务，可重复调用"""
+        if self.heartbeat_task is None or self.heartbeat_task.done():
+            self.heartbeat_task = asyncio.create_task(self.heartbeat_loop())
+    
+    async def heartbeat_loop(self):
+        """定期向所有连接发送心跳，并断开超时或空闲的连接"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"心跳检查失败: {e}")
+    
+    def heartbeat(self):
+        now = time.monotonic()
+        for room in list(self.rooms.values()):
+            for websocket, connection in list(room.manager.active_connections.items()):
+                if connection.closed:
+                    # 发送失败而关闭的连接，接收循环没有结束时在这里移除
+                    self.leave(room, websocket)
+                    continue
+                reason = connection.expired(now)
+                if reason is None:
+                    connection.ping()
+                    continue
+                # 先从房间中移除，之后的广播不再为它排队
+                metrics.connections_evicted.inc(reason)
+                self.leave(room, websocket)
+                asyncio.create_task(close_websocket(websocket, 1001 if reason == "idle" else 1011))
+    
+    def get_or_create(self, room_id, **options):
+        """房间设置（见Room）只在创建房间时生效"""
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = Room(room_id, self.backplane, **options)
+            self.rooms[room_id] = room
+        room.start()
+        return room
+    
+    def leave(self, room, websocket: WebSocket):
+        """连接离开房间，房间空了就销毁"""
+        room.manager.disconnect(websocket)
+        if room.is_empty() and self.rooms.get(room.room_id) is room:
+            room.close()
+            del self.rooms[room.room_id]
+
+async def run_ai_guess(room, hint):
+    try:
+        await room.ai_guess(hint)
+    except Exception as e:
+        print(f"AI猜词失败: {e}")
+
+def limit_points(connection, points):
+    """按连接的绘制限额处理一批绘制点，超出部分合并为关键点"""
+    allowed = connection.limiter.limit_points(points)
+    if len(allowed) < len(points):
+        metrics.rate_limited.inc("draw", "coalesced", amount=len(points) - len(allowed))
+    return allowed
+
+async def close_websocket(websocket: WebSocket, code):
+    """关闭连接，连接可能已经断开，忽略错误"""
+    try:
+        await websocket.close(code=code)
+    except Exception:
+        pass
+
+# 消息总线，BACKPLANE_URL未设置时只在本进程内同步
+backplane = create_backplane(os.environ.get("BACKPLANE_URL"))
+
+# 创建房间管理器实例
+rooms = RoomRegistry(backplane)
+
+# AI猜词服务，所有房间共用，设置AI_GUESS_API_KEY后调用视觉模型，未设置时为None
+ai_guesser = create_guesser_service()
+
+# 词库和猜词匹配索引是否已准备好
+word_bank_ready = False
+
+async def prepare_word_bank():
+    """第一次创建房间之前在线程中加载词库并建立猜词匹配索引，大词库不会让其他连接停顿"""
+    global word_bank_ready
+    if not word_bank_ready:
+        await asyncio.to_thread(lambda: matcher_for(default_word_bank()))
+        word_bank_ready = True
+
+# 默认房间号，客户端未指定房间时使用
+DEFAULT_ROOM = "default"
+
+def get_room_id(connection: HTTPConnection):
+    """从连接地址的room参数中读取房间号"""
+    room_id = connection.query_params.get("room", "").strip()[:64]
+    return room_id or DEFAULT_ROOM
+
+def get_room_options(websocket: WebSocket):
+    """从连接地址的参数中读取房间设置：词语类别category、难度difficulty、笔画简化容差simplify"""
+    options = {"category": websocket.query_params.get("category") or None}
+    difficulty = websocket.query_params.get("difficulty", "")
+    if difficulty.isdigit():
+        options["difficulty"] = int(difficulty)
+    try:
+        options["simplify_tolerance"] = min(max(float(websocket.query_params["simplify"]), 0), 10)
+    except (KeyError, ValueError):
+        pass
+    return options
+
+def collect_connections():
+    """各角色的连接数，未注册角色的连接记为none"""
+    counts = {("drawer",): 0, ("guesser",): 0, ("none",): 0}
+    for room in rooms.rooms.values():
+        manager = room.manager
+        counts[("drawer",)] += len(manager.drawers)
+        counts[("guesser",)] += len(manager.guessers)
+        counts[("none",)] += len(manager.active_connections) - len(manager.drawers) - len(manager.guessers)
+    return counts
+
+def collect_max_queue_depth():
+    """当前积压最多的连接的发送队列长度"""
+    depth = 0
+    for room in rooms.rooms.values():
+        for connection in room.manager.active_connections.values():
+            depth = max(depth, len(connection.queue))
+    return {(): depth}
+
+def collect_max_connection_age():
+    """当前存活最久的连接已建立的时长"""
+    now = time.monotonic()
+    ages = [
+        now - connection.connected_at
+        for room in rooms.rooms.values()
+        for connection in room.manager.active_connections.values()
+    ]
+    return {(): max(ages, default=0)}
+
+metrics.registry.gauge("tyf_connections", "当前连接数", ("role",), collect=collect_connections)
+metrics.registry.gauge("tyf_rooms", "当前房间数", collect=lambda: {(): len(rooms.rooms)})
+metrics.registry.gauge("tyf_send_queue_depth_max", "积压最多的连接的发送队列长度", collect=collect_max_queue_depth)
+metrics.registry.gauge("tyf_connection_age_seconds_max", "存活最久的连接已建立的时长", collect=collect_max_connection_age)
+
+# 画布图片，供看板、嵌入页面和CDN轮询，ETag由房间实例和画布版本号生成，画面没有变化时返回304
+CANVAS_MEDIA_TYPES = {"jpg": ("image/jpeg", ".jpg"), "png": ("image/png", ".png")}
+
+async def canvas_response(request: Request, image_format, width=None):
+    room = rooms.rooms.get(get_room_id(request))
+    if room is None or image_format not in CANVAS_MEDIA_TYPES:
+        return Response(status_code=404)
+    media_type, ext = CANVAS_MEDIA_TYPES[image_format]
+    game_state = room.game_state
+    etag = f'"{room.instance}-{game_state.version}-{image_format}' + (f'-{width}"' if width else '"')
+    headers = {"ETag": etag, "Cache-Control": "public, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    # 同一版本的编码结果由编码缓存共享
+    if width is None:
+        image = await game_state.encode_canvas(ext)
+    else:
+        image = await game_state.encode_thumbnail(width, ext)
+    return Response(image, media_type=media_type, headers=headers)
+
+@app.get("/canvas")
+async def get_canvas(request: Request, format: str = "jpg"):
+    """当前画布，room参数指定房间"""
+    return await canvas_response(request, format)
+
+@app.get("/canvas/thumbnail")
+async def get_canvas_thumbnail(request: Request, width: int = THUMBNAIL_WIDTH, format: str = "jpg"):
+    """当前画布的缩略图"""
+    width = min(max(width, THUMBNAIL_MIN_WIDTH), THUMBNAIL_MAX_WIDTH) // 16 * 16
+    return await canvas_response(request, format, width)
+
+# 运行指标，Prometheus文本格式
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # 处理WebSocket连接
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    await backplane.start()
+    await prepare_word_bank()
+    rooms.start()
+    room = rooms.get_or_create(get_room_id(websocket), **get_room_options(websocket))
+    game_state = room.game_state
+    manager = room.manager
     try:
+        connection = await manager.connect(websocket)
+        await room.wait_ready()
         while True:
-            data = await websocket.receive_json()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if connection.closed:
+                # 发送失败或发送队列溢出，连接已被关闭
+                break
+            limiter = connection.limiter
+            if not limiter.admit():
+                # 消息总数超出限额，不解析直接丢弃，持续刷屏的连接被断开
+                metrics.rate_limited.inc("message", "dropped")
+                if limiter.flooded:
+                    metrics.connections_evicted.inc("flood")
+                    await close_websocket(websocket, 1008)
+                    break
+                continue
+            if message.get("bytes") is not None:
+                connection.touch()
+                # 二进制绘制点，由画布广播任务按周期合并发送
+                metrics.messages_received.inc("draw_binary")
+                room.draw_batch(limit_points(connection, unpack_points(message["bytes"])))
+                continue
+            data = json_codec.loads(message["text"])
+            message_type = data.get("type")
+            metrics.messages_received.inc(message_type if message_type in CLIENT_MESSAGE_TYPES else "other")
+            connection.touch(active=message_type != "pong")
+            
+            if message_type == "pong":
+                connection.pong(data)
+                continue
+            
+            if message_type not in ("draw", "draw_batch") and not limiter.allow(message_type):
+                # 超出该类型的限额，丢弃并提示客户端
+                metrics.rate_limited.inc(message_type if message_type in CLIENT_MESSAGE_TYPES else "other", "dropped")
+                if limiter.notice():
+                    connection.send({"type": "rate_limited", "message_type": message_type})
+                continue
             
             # 处理不同类型的消息
             if data["type"] == "register":
                 # 注册用户类型
                 if data["role"] == "drawer":
                     manager.add_drawer(websocket)
+                    limiter.set_role("drawer")
                 elif data["role"] == "guesser":
                     manager.add_guesser(websocket)
-                await websocket.send_json({
+                    limiter.set_role("guesser")
+                # 客户端支持时使用二进制协议，否则使用JSON
+                connection.binary = bool(data.get("binary", False))
+                # 断线重连时带上之前的令牌和最后收到的画布序号
+                token = data.get("resume_token")
+                resumed = room.resume_session(token, data["role"])
+                if not resumed:
+                    token = room.create_session(data["role"])
+                connection.send({
                     "type": "game_state",
                     "current_word": game_state.current_word,
-                    "is_game_active": game_state.is_game_active
+                    "is_game_active": game_state.is_game_active,
+                    "guesses": list(game_state.guesses),
+                    "binary": connection.binary,
+                    "resume_token": token,
+                    "ai_guess": ai_guesser is not None
                 })
+                if data["role"] == "guesser":
+                    # 新加入的猜词者收到关键帧和其后的增量，重连的猜词者只收到错过的增量
+                    for canvas_message in game_state.catch_up(data.get("last_seq") if resumed else None):
+                        connection.send(canvas_message)
             
             elif data["type"] == "draw":
                 # 更新画布
-                x = data["x"]
-                y = data["y"]
-                drawing = data["drawing"]
-                # 获取颜色信息，如果没有提供则使用当前颜色
-                color = data.get("color", None)
-                game_state.update_canvas(x, y, drawing, color)
-                
-                # 广播画布更新
-                await manager.broadcast_to_guessers({
-                    "type": "canvas_update",
-                    "canvas": base64.b64encode(cv2.imencode('.jpg', game_state.canvas)[1]).decode('utf-8')
-                })
+                # 颜色没有提供时使用当前颜色
+                point = read_point(data)
+                # 只标记画布变化，由画布广播任务按周期合并发送
+                for point in limit_points(connection, [point]):
+                    room.draw(*point)
+            
+            elif data["type"] == "draw_batch":
+                # 一条消息中按顺序携带多个绘制点
+                room.draw_batch(limit_points(connection, [read_point(point) for point in data["points"]]))
             
             elif data["type"] == "clear":
-                # 清空画布
+                # 清空画布，下个周期发送完整画面
+                room.drain_strokes()
                 game_state.clear_canvas()
-                await manager.broadcast_to_guessers({
-                    "type": "canvas_update",
-                    "canvas": base64.b64encode(cv2.imencode('.jpg', game_state.canvas)[1]).decode('utf-8')
-                })
+                await room.publish({"op": "clear"})
             
             elif data["type"] == "canvas_update":
                 # 从客户端接收画布更新（当画画者按f键保存并上传时）
                 canvas_data = data.get("canvas", None)
-                if canvas_data:
-                    # 直接广播客户端上传的画布数据给所有猜词者
+                image = decode_canvas_upload(canvas_data) if canvas_data else None
+                if image:
+                    # 直接广播客户端上传的画布数据给所有猜词者，收到时已解码，数据有误的上传被忽略
                     await manager.broadcast_to_guessers({
                         "type": "canvas_update",
-                        "canvas": canvas_data
+                        "image": image
                     })
+                    await room.publish({"op": "canvas_upload", "canvas": canvas_data})
             
             elif data["type"] == "guess":
                 # 处理猜词
-                guess = data["guess"]
-                is_correct = game_state.add_guess(guess)
+                guess = str(data["guess"])[:50]
+                record = game_state.add_guess(guess)
                 
                 # 向所有客户端广播猜测结果
-                await manager.broadcast({
-                    "type": "guess_result",
-                    "guess": guess,
-                    "is_correct": is_correct,
-                    "guesses": game_state.guesses
-                })
+                await room.announce_guess(record)
+                await room.publish({"op": "guess", **record})
                 
-                if is_correct:
+                if record["is_correct"]:
                     # 游戏结束，重置游戏
-                    game_state.reset_game()
-                    await manager.broadcast({
-                        "type": "game_reset",
-                        "current_word": game_state.current_word
-                    })
+                    room.reset_game()
+                    await room.announce_reset()
+                    await room.publish({"op": "reset", "current_word": game_state.current_word})
+            
+            elif data["type"] == "ai_guess":
+                if ai_guesser is None:
+                    # 未配置视觉模型，客户端收到后隐藏按钮
+                    connection.send({"type": "ai_guess_unavailable"})
+                    continue
+                # 请AI猜测当前画面，不等待结果，继续处理其他消息
+                hint = str(data.get("hint", ""))[:50]
+                asyncio.create_task(run_ai_guess(room, hint))
             
             elif data["type"] == "reset":
                 # 重置游戏
-                game_state.reset_game()
-                await manager.broadcast({
-                    "type": "game_reset",
-                    "current_word": game_state.current_word
-                })
+                room.reset_game()
+                await room.announce_reset()
+                await room.publish({"op": "reset", "current_word": game_state.current_word})
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
-
-# 创建静态文件目录
-if not os.path.exists("static"):
-    os.makedirs("static")
+        pass
+    finally:
+        rooms.leave(room, websocket)
 
-# 提供静态文件服务
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
-# 保存HTML文件
+# 网页客户端，启动时压缩好后直接从内存提供
 html_content = '''
 <!DOCTYPE html>
 <html lang="zh-CN">
@@ -357,6 +1446,10 @@ html_content = '''
             background-color: #f8d7da;
             color: #721c24;
         }
+        .close {
+            background-color: #fff3cd;
+            color: #856404;
+        }
         .word-display {
             background-color: #fff3cd;
             padding: 15px;
@@ -407,6 +1500,7 @@ html_content = '''
                 <div class="guess-input">
                     <input type="text" id="guessInput" placeholder="请输入你的猜测...">
                     <button onclick="submitGuess()">提交猜测</button>
+                    <button id="aiGuessButton" onclick="requestAiGuess()">AI猜一猜</button>
                 </div>
                 <div class="guess-history">
                     <h3>猜测记录</h3>
@@ -430,19 +1524,33 @@ html_content = '''
         function initWebSocket() {
             const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
             const host = window.location.host;
-            ws = new WebSocket(`${protocol}//${host}/ws`);
+            // 页面地址中的room参数决定加入哪个房间
+            const room = new URLSearchParams(window.location.search).get('room') || 'default';
+            ws = new WebSocket(`${protocol}//${host}/ws?room=${encodeURIComponent(room)}`);
             
             ws.onopen = function() {
                 console.log('WebSocket连接已建立');
+                // 断线重连后恢复会话，服务器只补发错过的画布内容
+                if (role) sendRegister();
             };
             
+            ws.binaryType = 'arraybuffer';
             ws.onmessage = function(event) {
+                if (event.data instanceof ArrayBuffer) {
+                    handleBinaryMessage(event.data);
+                    return;
+                }
                 const data = JSON.parse(event.data);
                 handleMessage(data);
             };
             
-            ws.onclose = function() {
+            ws.onclose = function(event) {
                 console.log('WebSocket连接已关闭');
+                // 因长时间未操作（1001）或消息过多（1008）被服务器断开时不自动重连，等玩家点击后再加入
+                if (event.code === 1001 || event.code === 1008) {
+                    showRejoinPrompt(event.code === 1001 ? '长时间未操作，已断开连接' : '消息过多，已断开连接');
+                    return;
+                }
                 setTimeout(initWebSocket, 1000); // 尝试重新连接
             };
             
@@ -451,35 +1559,249 @@ html_content = '''
             };
         }
         
+        // 显示断开提示，点击后重新连接并恢复会话
+        function showRejoinPrompt(message) {
+            const prompt = document.createElement('div');
+            prompt.style.cssText = 'position: fixed; top: 10px; right: 10px; padding: 10px 20px; border-radius: 5px; color: white; font-weight: bold; background-color: #ff9800; cursor: pointer; z-index: 1000;';
+            prompt.textContent = message + '，点击重新加入';
+            prompt.onclick = function() {
+                prompt.remove();
+                initWebSocket();
+            };
+            document.body.appendChild(prompt);
+        }
+        
+        // 观看画布上的操作按到达顺序执行；图片需要异步解码，解码期间后续操作排队等待
+        let canvasOps = [];
+        let canvasBusy = false;
+        let canvasGeneration = 0;
+        
+        // 加入一个画布操作：{ segments } 为线段增量，{ images, full } 为关键帧或分块图片
+        function enqueueCanvasOp(op) {
+            canvasOps.push(op);
+            if (!canvasBusy) runCanvasOps();
+        }
+        
+        // 依次执行排队的画布操作
+        function runCanvasOps() {
+            while (canvasOps.length > 0) {
+                const op = canvasOps.shift();
+                if (op.segments) {
+                    paintSegments(op.segments);
+                    continue;
+                }
+                canvasBusy = true;
+                const generation = canvasGeneration;
+                Promise.all(op.images.map(loadImage)).then(function(imgs) {
+                    if (generation !== canvasGeneration) return;
+                    const canvas = document.getElementById('viewCanvas');
+                    const ctx = canvas.getContext('2d');
+                    if (op.full) {
+                        // 确保画布背景为白色，支持彩色显示
+                        ctx.fillStyle = 'white';
+                        ctx.fillRect(0, 0, canvas.width, canvas.height);
+                    }
+                    imgs.forEach(function(img, i) {
+                        if (img) ctx.drawImage(img, op.images[i].x, op.images[i].y);
+                        if (op.images[i].src.startsWith('blob:')) URL.revokeObjectURL(op.images[i].src);
+                    });
+                    canvasBusy = false;
+                    runCanvasOps();
+                });
+                return;
+            }
+        }
+        
+        // 加载一张图片，失败时返回null
+        function loadImage(image) {
+            return new Promise(function(resolve) {
+                const img = new Image();
+                img.onload = function() { resolve(img); };
+                img.onerror = function() { resolve(null); };
+                img.src = image.src;
+            });
+        }
+        
+        // 在观看画布上绘制线段
+        function paintSegments(segments) {
+            const ctx = document.getElementById('viewCanvas').getContext('2d');
+            ctx.lineCap = 'round';
+            ctx.lineJoin = 'round';
+            for (const seg of segments) {
+                // 服务器使用BGR颜色格式
+                ctx.strokeStyle = `rgb(${seg.color[2]}, ${seg.color[1]}, ${seg.color[0]})`;
+                ctx.lineWidth = seg.thickness;
+                ctx.beginPath();
+                ctx.moveTo(seg.from[0], seg.from[1]);
+                ctx.lineTo(seg.to[0], seg.to[1]);
+                ctx.stroke();
+            }
+        }
+        
+        // 线段增量
+        function drawSegments(segments) {
+            enqueueCanvasOp({ segments: segments });
+        }
+        
+        // 用完整关键帧覆盖观看画布，src为图片地址；之前尚未执行的操作都已包含在关键帧中
+        function drawKeyframe(src) {
+            canvasGeneration++;
+            canvasOps = [];
+            canvasBusy = false;
+            enqueueCanvasOp({ images: [{ src: src, x: 0, y: 0 }], full: true });
+        }
+        
+        // 把变化的分块贴回观看画布，tiles为 [{ src, x, y }]
+        function drawTiles(tiles) {
+            enqueueCanvasOp({ images: tiles, full: false });
+        }
+        
+        // 清空观看画布
+        function clearViewCanvas() {
+            canvasGeneration++;
+            canvasOps = [];
+            canvasBusy = false;
+            const canvas = document.getElementById('viewCanvas');
+            const ctx = canvas.getContext('2d');
+            ctx.fillStyle = 'white';
+            ctx.fillRect(0, 0, canvas.width, canvas.height);
+        }
+        
+        // 二进制协议（与服务器中的FRAME_*常量对应）
+        const FRAME_KEYFRAME = 0x01;
+        const FRAME_STROKE = 0x02;
+        const FRAME_TILES = 0x03;
+        const FRAME_DRAW = 0x10;
+        const FRAME_HEADER_SIZE = 5;
+        const SEGMENT_SIZE = 12;
+        const POINT_SIZE = 8;
+        const POINT_DRAWING = 0x01;
+        // 服务器确认支持后使用二进制协议，否则使用JSON
+        let binaryMode = false;
+        
+        // 处理接收到的二进制帧
+        function handleBinaryMessage(buffer) {
+            const view = new DataView(buffer);
+            // 帧头：帧类型和画布序号
+            const frameType = view.getUint8(0);
+            const seq = view.getUint32(1, true);
+            if (seq > 0) lastSeq = seq;
+            if (frameType === FRAME_KEYFRAME) {
+                const blob = new Blob([new Uint8Array(buffer, FRAME_HEADER_SIZE)], { type: 'image/jpeg' });
+                drawKeyframe(URL.createObjectURL(blob));
+            } else if (frameType === FRAME_STROKE) {
+                const segments = [];
+                for (let offset = FRAME_HEADER_SIZE; offset + SEGMENT_SIZE <= buffer.byteLength; offset += SEGMENT_SIZE) {
+                    segments.push({
+                        from: [view.getInt16(offset, true), view.getInt16(offset + 2, true)],
+                        to: [view.getInt16(offset + 4, true), view.getInt16(offset + 6, true)],
+                        color: [view.getUint8(offset + 8), view.getUint8(offset + 9), view.getUint8(offset + 10)],
+                        thickness: view.getUint8(offset + 11)
+                    });
+                }
+                drawSegments(segments);
+            } else if (frameType === FRAME_TILES) {
+                // 分块记录：x, y, 数据长度, JPEG数据
+                const tiles = [];
+                let offset = FRAME_HEADER_SIZE;
+                while (offset + 8 <= buffer.byteLength) {
+                    const length = view.getUint32(offset + 4, true);
+                    const blob = new Blob([new Uint8Array(buffer, offset + 8, length)], { type: 'image/jpeg' });
+                    tiles.push({
+                        src: URL.createObjectURL(blob),
+                        x: view.getInt16(offset, true),
+                        y: view.getInt16(offset + 2, true)
+                    });
+                    offset += 8 + length;
+                }
+                drawTiles(tiles);
+            }
+        }
+        
+        // 待发送的绘制点，每个动画帧合并发送一次
+        let pendingPoints = [];
+        let flushScheduled = false;
+        
+        // 记录一个绘制点，在下一个动画帧批量发送
+        function sendDrawPoint(x, y, drawing) {
+            pendingPoints.push({ x: Math.round(x), y: Math.round(y), drawing: drawing });
+            if (!flushScheduled) {
+                flushScheduled = true;
+                requestAnimationFrame(flushDrawPoints);
+            }
+        }
+        
+        // 发送所有待发送的绘制点
+        function flushDrawPoints() {
+            flushScheduled = false;
+            if (pendingPoints.length === 0) return;
+            const points = pendingPoints;
+            pendingPoints = [];
+            if (ws.readyState !== WebSocket.OPEN) return;
+            if (binaryMode) {
+                const view = new DataView(new ArrayBuffer(1 + POINT_SIZE * points.length));
+                view.setUint8(0, FRAME_DRAW);
+                points.forEach((point, i) => {
+                    const offset = 1 + i * POINT_SIZE;
+                    view.setInt16(offset, point.x, true);
+                    view.setInt16(offset + 2, point.y, true);
+                    view.setUint8(offset + 4, point.drawing ? POINT_DRAWING : 0);
+                });
+                ws.send(view.buffer);
+            } else {
+                ws.send(JSON.stringify({ type: 'draw_batch', points: points }));
+            }
+        }
+        
         // 处理接收到的消息
         function handleMessage(data) {
+            if (data.type === 'ping') {
+                // 回复服务器心跳，长时间不回复的连接会被断开
+                ws.send(JSON.stringify({ type: 'pong', t: data.t }));
+                return;
+            }
+            if (data.seq) lastSeq = data.seq;
             if (data.type === 'game_state') {
                 document.getElementById('currentWord').textContent = data.current_word;
+                if ('binary' in data) binaryMode = data.binary;
+                // 服务器未配置视觉模型时不显示AI猜词按钮
+                if ('ai_guess' in data) setAiGuessAvailable(data.ai_guess);
+                if (data.resume_token) resumeToken = data.resume_token;
+                // 加入或重连时服务器发送完整的猜测记录
+                if (data.guesses) {
+                    document.getElementById('guessHistory').innerHTML = '';
+                    document.getElementById('guessHistory2').innerHTML = '';
+                    data.guesses.forEach(updateGuessHistory);
+                }
             } else if (data.type === 'canvas_update') {
-                // 更新画布
-                const img = new Image();
-                img.onload = function() {
-                    const canvas = document.getElementById('viewCanvas');
-                    const ctx = canvas.getContext('2d');
-                    // 确保画布背景为白色，支持彩色显示
-                    ctx.fillStyle = 'white';
-                    ctx.fillRect(0, 0, canvas.width, canvas.height);
-                    // 绘制彩色图像
-                    ctx.drawImage(img, 0, 0);
-                };
-                img.src = 'data:image/jpeg;base64,' + data.canvas;
+                // 完整画面（关键帧）
+                drawKeyframe('data:image/jpeg;base64,' + data.canvas);
+            } else if (data.type === 'canvas_tiles') {
+                // 只包含变化区域的分块图片
+                drawTiles(data.tiles.map(function(tile) {
+                    return { src: 'data:image/jpeg;base64,' + tile.canvas, x: tile.x, y: tile.y };
+                }));
+            } else if (data.type === 'stroke') {
+                // 线段增量，本地绘制
+                drawSegments(data.segments);
             } else if (data.type === 'guess_result') {
                 // 更新猜测记录
                 updateGuessHistory(data);
+            } else if (data.type === 'ai_guess_result') {
+                // AI的猜测只显示，不计入猜测记录
+                updateGuessHistory({ guess: 'AI: ' + data.guess, is_correct: data.is_correct });
                 
                 // 如果猜测正确，显示正确答案
                 if (data.is_correct) {
                     showCorrectAnswer();
                 }
+            } else if (data.type === 'ai_guess_unavailable') {
+                setAiGuessAvailable(false);
             } else if (data.type === 'game_reset') {
                 // 重置游戏
                 document.getElementById('currentWord').textContent = data.current_word;
                 clearCanvas();
+                clearViewCanvas();
                 document.getElementById('guessInput').value = '';
                 document.getElementById('guessHistory').innerHTML = '';
                 document.getElementById('guessHistory2').innerHTML = '';
@@ -488,10 +1810,25 @@ html_content = '''
             }
         }
         
+        // 会话令牌和最后收到的画布序号，用于断线重连
+        let resumeToken = null;
+        let lastSeq = 0;
+        
+        // 向服务器注册角色
+        function sendRegister() {
+            ws.send(JSON.stringify({
+                type: 'register',
+                role: role,
+                binary: true,
+                resume_token: resumeToken,
+                last_seq: lastSeq
+            }));
+        }
+        
         // 注册用户角色
         function registerRole(roleType) {
             role = roleType;
-            ws.send(JSON.stringify({ type: 'register', role: role }));
+            sendRegister();
             
             // 显示相应的游戏区域
             document.getElementById('roleSelection').classList.add('hidden');
@@ -567,12 +1904,7 @@ html_content = '''
             ctx.stroke();
             
             // 发送绘制数据到服务器
-            ws.send(JSON.stringify({
-                type: 'draw',
-                x: x,
-                y: y,
-                drawing: true
-            }));
+            sendDrawPoint(x, y, true);
             
             lastX = x;
             lastY = y;
@@ -582,12 +1914,7 @@ html_content = '''
         function stopDrawing() {
             if (isDrawing) {
                 isDrawing = false;
-                ws.send(JSON.stringify({
-                    type: 'draw',
-                    x: lastX,
-                    y: lastY,
-                    drawing: false
-                }));
+                sendDrawPoint(lastX, lastY, false);
             }
         }
         
@@ -597,6 +1924,8 @@ html_content = '''
             // 使用白色填充整个画布，确保彩色支持
             ctx.fillStyle = 'white';
             ctx.fillRect(0, 0, 640, 480);
+            // 先发送之前的绘制点，保证清空在它们之后执行
+            flushDrawPoints();
             ws.send(JSON.stringify({ type: 'clear' }));
         }
         
@@ -609,6 +1938,16 @@ html_content = '''
             }
         }
         
+        // 显示或隐藏AI猜词按钮
+        function setAiGuessAvailable(available) {
+            document.getElementById('aiGuessButton').style.display = available ? '' : 'none';
+        }
+        
+        // 请服务器上的AI猜测当前画面
+        function requestAiGuess() {
+            ws.send(JSON.stringify({ type: 'ai_guess' }));
+        }
+        
         // 重置游戏
         function resetGame() {
             ws.send(JSON.stringify({ type: 'reset' }));
@@ -617,8 +1956,10 @@ html_content = '''
         // 更新猜测记录
         function updateGuessHistory(data) {
             const guessItem = document.createElement('div');
-            guessItem.className = 'guess-item ' + (data.is_correct ? 'correct' : 'incorrect');
-            guessItem.textContent = data.guess + (data.is_correct ? ' ✓' : ' ✗');
+            // 接近的猜测单独标出，提示猜词者方向是对的
+            const close = !data.is_correct && data.match === 'close';
+            guessItem.className = 'guess-item ' + (data.is_correct ? 'correct' : close ? 'close' : 'incorrect');
+            guessItem.textContent = data.guess + (data.is_correct ? ' ✓' : close ? ' ≈ 接近了' : ' ✗');
             
             document.getElementById('guessHistory').appendChild(guessItem);
             document.getElementById('guessHistory2').appendChild(guessItem.cloneNode(true));
@@ -651,8 +1992,16 @@ html_content = '''
 </html>
 '''
 
-with open("static/index.html", "w", encoding="utf-8") as f:
-    f.write(html_content)
+index_page = CompressedBody(html_content.encode('utf-8'), "text/html; charset=utf-8")
+
+@app.get("/")
+@app.get("/static/index.html")
+async def get_index(request: Request):
+    return index_page.response(request)
+
+# static目录存在时提供其中的其他静态文件
+if os.path.isdir("static"):
+    app.mount("/static", StaticFiles(directory="static"), name="static")
 
 def get_local_ip():
     """获取本地IP地址"""
@@ -671,9 +2020,19 @@ def get_local_ip():
 
 # 启动服务器
 if __name__ == "__main__":
+    import uvicorn
     print("正在启动服务器...")
     local_ip = get_local_ip()
     print(f"本地访问地址: http://localhost:8001/static/index.html")
     print(f"外部访问地址: http://{local_ip}:8001/static/index.html")
     print("其他设备可以通过上面的外部访问地址访问游戏")
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # 多个工作进程需要通过BACKPLANE_URL共享消息总线（先运行 python tyf_backplane.py）
+    # 连接在各工作进程之间任意分配，同一房间的玩家在不同进程中也能通过消息总线同步；
+    # 希望同一房间尽量在一个进程内处理时，由前端代理按room参数做一致性哈希
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+    if workers > 1:
+        if not os.environ.get("BACKPLANE_URL"):
+            print("警告: 未设置BACKPLANE_URL，不同工作进程中的玩家将无法互相看到")
+        uvicorn.run("tyf_multiplayer:app", host="0.0.0.0", port=8001, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8001)
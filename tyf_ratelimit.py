@@ -0,0 +1,160 @@
+import json
+import os
+import time
+
+# 限流：每个连接按消息类型各有一个令牌桶，速率和容量按角色配置
+# 令牌以固定速率补充，最多攒到容量，每条消息消耗一个令牌，绘制消息按点数消耗
+# 绘制点超出限额时只保留笔画的关键点（抬笔、换色），笔画仍然连续；其他消息直接丢弃
+# 另有一个不区分类型的总消息桶，在解析消息之前检查，连续大量超出的连接会被断开
+
+# 各角色每种消息的 (每秒令牌数, 容量)；"*"为所有角色的默认值，未注册角色的连接为none，未列出的类型不限制
+# 可以用环境变量RATE_LIMITS（JSON，结构相同）覆盖，例如 {"guesser": {"guess": [1, 3]}}
+DEFAULT_RATE_LIMITS = {
+    "*": {
+        "register": (1, 5),
+        "draw": (240, 480),
+        "clear": (1, 5),
+        "reset": (0.2, 3),
+        "canvas_update": (0.5, 3),
+        "guess": (2, 10),
+        "ai_guess": (0.5, 3)
+    },
+    "guesser": {
+        # 猜词者正常情况下不画画
+        "draw": (60, 120),
+        "clear": (0.2, 1)
+    }
+}
+# 每个连接每秒的消息总数和容量
+MESSAGE_RATE_LIMIT = float(os.environ.get("MESSAGE_RATE_LIMIT", 120))
+MESSAGE_BURST = float(os.environ.get("MESSAGE_BURST", 240))
+# 持续超出总消息限额、累计被丢弃的消息数达到此值时断开连接，0为不断开
+FLOOD_DISCONNECT_DROPS = int(os.environ.get("FLOOD_DISCONNECT_DROPS", 500))
+# 超出限额的一批绘制点合并后最多保留的点数
+COALESCE_MAX_POINTS = 8
+# 向客户端发送限流提示的最短间隔（秒）
+RATE_LIMIT_NOTICE_INTERVAL = 1.0
+
+def load_rate_limits(overrides=None):
+    """合并默认限额和覆盖值，返回 {角色: {消息类型: (速率, 容量)}}"""
+    limits = {role: dict(types) for role, types in DEFAULT_RATE_LIMITS.items()}
+    for role, types in (overrides or {}).items():
+        limits.setdefault(role, {}).update({name: tuple(limit) for name, limit in types.items()})
+    return limits
+
+RATE_LIMITS = load_rate_limits(json.loads(os.environ.get("RATE_LIMITS", "{}")))
+
+class TokenBucket:
+    """令牌桶"""
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, cost=1, now=None):
+        """令牌足够时消耗并返回True"""
+        self.refill(time.monotonic() if now is None else now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def take_up_to(self, cost, now=None):
+        """尽量消耗cost个令牌，返回实际消耗的整数个数"""
+        self.refill(time.monotonic() if now is None else now)
+        granted = min(int(self.tokens), cost)
+        self.tokens -= granted
+        return granted
+
+def coalesce_points(points, max_points=COALESCE_MAX_POINTS):
+    """只保留笔画的关键点：抬笔、换色的点，以及一批中的最后一个点，最多保留最后max_points个
+
+    被去掉的点都在笔画中间（或是笔画的起点），前后保留的点之间仍然连线，只是少了细节。
+    单独一个点的消息不保留最后一个点，相当于合并到之后的点上。
+    """
+    kept = [
+        point for i, point in enumerate(points)
+        if not point[2] or point[3] is not None or (i == len(points) - 1 and len(points) > 1)
+    ]
+    return kept[-max_points:]
+
+class RateLimiter:
+    """一个连接的限流状态，在事件循环中使用"""
+    def __init__(self, role="none", limits=None, message_rate=MESSAGE_RATE_LIMIT, message_burst=MESSAGE_BURST):
+        self.limits = limits if limits is not None else RATE_LIMITS
+        self.role = role
+        self.messages = TokenBucket(message_rate, message_burst)
+        self.buckets = {}  # 消息类型 -> 令牌桶，第一次收到该类型时创建
+        self.flooding = 0  # 超出总消息限额以来被丢弃的消息数
+        self.last_notice = 0.0
+
+    def limit(self, message_type):
+        limit = self.limits.get(self.role, {}).get(message_type)
+        if limit is None:
+            limit = self.limits.get("*", {}).get(message_type)
+        return limit
+
+    def set_role(self, role):
+        """注册角色后按新角色的限额继续计数，已经消耗的令牌不会因此恢复"""
+        self.role = role
+        for message_type, bucket in list(self.buckets.items()):
+            limit = self.limit(message_type)
+            if limit is None:
+                del self.buckets[message_type]
+            else:
+                bucket.rate, bucket.burst = limit
+                bucket.tokens = min(bucket.tokens, bucket.burst)
+
+    def bucket(self, message_type):
+        bucket = self.buckets.get(message_type)
+        if bucket is None:
+            limit = self.limit(message_type)
+            if limit is None:
+                return None
+            bucket = self.buckets[message_type] = TokenBucket(*limit)
+        return bucket
+
+    def admit(self):
+        """解析消息之前调用，总消息数超出限额时返回False"""
+        if self.messages.take():
+            if self.messages.tokens >= self.messages.burst / 2:
+                # 客户端已经放慢，令牌攒回一半后才清零，持续刷屏时计数不会被偶尔放行的消息清掉
+                self.flooding = 0
+            return True
+        self.flooding += 1
+        return False
+
+    @property
+    def flooded(self):
+        """是否应断开连接"""
+        return FLOOD_DISCONNECT_DROPS > 0 and self.flooding >= FLOOD_DISCONNECT_DROPS
+
+    def allow(self, message_type, cost=1):
+        """消息是否在限额内，未限制的类型总是返回True"""
+        bucket = self.bucket(message_type)
+        return bucket is None or bucket.take(cost)
+
+    def limit_points(self, points):
+        """返回限额内可以绘制的点，超出部分合并为关键点"""
+        bucket = self.bucket("draw")
+        if bucket is None:
+            return points
+        granted = bucket.take_up_to(len(points))
+        if granted == len(points):
+            return points
+        return points[:granted] + coalesce_points(points[granted:])
+
+    def notice(self):
+        """是否应向客户端发送限流提示，避免提示本身刷屏"""
+        now = time.monotonic()
+        if now - self.last_notice < RATE_LIMIT_NOTICE_INTERVAL:
+            return False
+        self.last_notice = now
+        return True
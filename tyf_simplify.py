@@ -0,0 +1,106 @@
+import os
+
+# 笔画简化：在绘制点进入 GameState.update_canvas 之前去掉多余的点
+# 1. 距离阈值：与上一个保留点距离小于容差的点先不绘制（笔画结束时补上最后一个点）
+# 2. Ramer–Douglas–Peucker：对尚未结束的笔画按窗口简化，去掉与前后连线偏差小于容差的点
+# 窗口在攒满、笔画结束、颜色变化或房间刷新周期到来时处理，因此最多延迟一个广播周期
+
+# 默认容差（像素），0为不简化；房间可通过连接地址的simplify参数单独设置
+STROKE_SIMPLIFY_TOLERANCE = float(os.environ.get("STROKE_SIMPLIFY_TOLERANCE", 1.0))
+# 窗口内最多累积的点数
+STROKE_SIMPLIFY_WINDOW = 32
+
+def rdp(points, tolerance):
+    """Ramer–Douglas–Peucker简化，保留首尾两点，返回保留的点列表"""
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    tolerance_sq = tolerance * tolerance
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        (x0, y0), (x1, y1) = points[start], points[end]
+        dx, dy = x1 - x0, y1 - y0
+        length_sq = dx * dx + dy * dy
+        farthest, farthest_sq = None, tolerance_sq
+        for i in range(start + 1, end):
+            px, py = points[i]
+            if length_sq == 0:
+                distance_sq = (px - x0) ** 2 + (py - y0) ** 2
+            else:
+                # 点到直线距离的平方：叉积的平方 / 线段长度的平方
+                cross = dx * (py - y0) - dy * (px - x0)
+                distance_sq = cross * cross / length_sq
+            if distance_sq > farthest_sq:
+                farthest, farthest_sq = i, distance_sq
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((start, farthest))
+            stack.append((farthest, end))
+    return [point for point, kept in zip(points, keep) if kept]
+
+class StrokeSimplifier:
+    """流式笔画简化器，输入和输出都是 (x, y, drawing, color) 绘制点"""
+    def __init__(self, tolerance=STROKE_SIMPLIFY_TOLERANCE, window=STROKE_SIMPLIFY_WINDOW):
+        self.tolerance = tolerance
+        self.window = window
+        self.points = []  # 当前窗口，第一个点是已经输出过的锚点
+        self.tail = None  # 因距离太近暂未保留的最新一个点
+        self.color = None  # 最近一次输出的颜色
+
+    def push(self, point):
+        """输入一个绘制点，返回可以立即绘制的点列表"""
+        if self.tolerance <= 0:
+            return [point]
+        x, y, drawing, color = point
+        if color is not None and tuple(color) == self.color:
+            color = None
+        if not drawing:
+            if not self.points and color is None:
+                # 已经抬笔，重复的抬笔点没有作用
+                return []
+            # 笔画结束：先输出窗口中剩余的点，再输出抬笔
+            output = self.flush()
+            self.points = []
+            return self.emit(output + [(x, y, False, color)])
+        if not self.points or color is not None:
+            # 笔画开始或颜色变化：输出之前的点，当前点作为新的锚点
+            output = self.flush()
+            self.points = [(x, y)]
+            return self.emit(output + [(x, y, True, color)])
+        last_x, last_y = self.points[-1]
+        if (x - last_x) ** 2 + (y - last_y) ** 2 < self.tolerance * self.tolerance:
+            self.tail = (x, y)
+            return []
+        self.tail = None
+        self.points.append((x, y))
+        if len(self.points) >= self.window:
+            return self.emit(self.flush())
+        return []
+
+    def flush(self):
+        """简化并输出窗口中的点，窗口的最后一个点成为下一个窗口的锚点"""
+        if self.tail is not None:
+            self.points.append(self.tail)
+            self.tail = None
+        if len(self.points) < 2:
+            return []
+        kept = rdp(self.points, self.tolerance)
+        self.points = [self.points[-1]]
+        return [(x, y, True, None) for x, y in kept[1:]]
+
+    def drain(self):
+        """房间刷新周期调用，输出所有已缓存的点"""
+        return self.emit(self.flush())
+
+    def reset(self):
+        """丢弃缓存的点（例如游戏重置时）"""
+        self.points = []
+        self.tail = None
+
+    def emit(self, points):
+        for point in points:
+            if point[3] is not None:
+                self.color = tuple(point[3])
+        return points
@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# 启动性能基准：在全新的子进程中导入服务器模块，测量导入耗时和内存，
+# 并检查没有导入服务器用不到的重量级依赖。超过阈值时以非零状态退出，可用于CI
+# 例如：python tyf_startup_bench.py --runs 5 --max-seconds 1.5
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 服务器不应导入的模块（手势客户端才需要）
+FORBIDDEN_MODULES = ("mediapipe", "requests", "PIL", "matplotlib")
+
+# 在子进程中执行的测量代码
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"seconds": elapsed, "max_rss_kb": rss, "modules": sorted(sys.modules)}}))
+"""
+
+def measure(module="tyf_multiplayer"):
+    """在临时目录中启动一个新解释器导入模块，返回测量结果"""
+    env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    with tempfile.TemporaryDirectory(prefix="tyf_startup_") as workdir:
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module)],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        # 导入时不应在工作目录中写入任何文件
+        written = os.listdir(workdir)
+    result = json.loads(output.strip().splitlines()[-1])
+    result["written"] = written
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="服务器启动性能基准")
+    parser.add_argument("--module", default="tyf_multiplayer", help="要导入的模块")
+    parser.add_argument("--runs", type=int, default=5, help="测量次数，取中位数")
+    parser.add_argument("--max-seconds", type=float, help="导入耗时中位数的上限")
+    parser.add_argument("--max-rss-mb", type=float, help="导入后峰值内存的上限")
+    args = parser.parse_args(argv)
+
+    results = [measure(args.module) for _ in range(args.runs)]
+    seconds = statistics.median(result["seconds"] for result in results)
+    # Linux上ru_maxrss的单位为KB
+    rss_mb = statistics.median(result["max_rss_kb"] for result in results) / 1024
+    forbidden = sorted({
+        name.split(".")[0] for result in results for name in result["modules"]
+    } & set(FORBIDDEN_MODULES))
+    written = sorted({name for result in results for name in result["written"]})
+    print(f"导入 {args.module}: 中位数 {seconds * 1000:.0f}ms，峰值内存 {rss_mb:.1f}MB（{args.runs} 次）")
+
+    failures = []
+    if forbidden:
+        failures.append(f"导入了服务器不需要的模块: {', '.join(forbidden)}")
+    if written:
+        failures.append(f"导入时写入了文件: {', '.join(written)}")
+    if args.max_seconds is not None and seconds > args.max_seconds:
+        failures.append(f"导入耗时 {seconds:.3f}s 超过上限 {args.max_seconds}s")
+    if args.max_rss_mb is not None and rss_mb > args.max_rss_mb:
+        failures.append(f"峰值内存 {rss_mb:.1f}MB 超过上限 {args.max_rss_mb}MB")
+    for failure in failures:
+        print(f"失败: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
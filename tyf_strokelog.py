@@ -0,0 +1,219 @@
+import os
+import re
+import struct
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# 笔画日志：每局一个只追加的二进制文件，记录画布上的每条线段和清空操作
+# 写入先缓存在内存中，由房间的广播任务定期在线程池中批量写入并fsync
+# 回放时用np.memmap直接映射文件，不需要逐条解析
+#
+# 文件布局（小端序）：
+#   文件头：魔数 b"TYFS"、版本（1字节）、词语长度（2字节）、词语（UTF-8）
+#   记录：固定13字节，见 RECORD_DTYPE
+# 进行中的一局文件名以 .part 结尾，这一局结束后改名为 .strokes；
+# 进程崩溃后留下的 .part 文件在房间重新创建时回放恢复
+# 同一房间分布在多个工作进程时，每个节点只记录本节点产生的操作，文件名带有节点名称，
+# 各节点只写入和恢复自己的文件，例如 1700000000000-a1b2c3d4.strokes.part
+
+# 保存目录，设为空字符串时不记录
+DRAWINGS_DIR = os.environ.get("DRAWINGS_DIR", "drawings")
+# 两次批量写入之间的最长间隔（秒）
+STROKE_LOG_FLUSH_INTERVAL = float(os.environ.get("STROKE_LOG_FLUSH_INTERVAL", 1.0))
+
+MAGIC = b"TYFS"
+VERSION = 1
+HEADER_STRUCT = struct.Struct("<4sBH")
+
+OP_SEGMENT = 1  # 线段
+OP_CLEAR = 2  # 清空画布
+OP_IMAGE = 3  # 载入整幅画面，x0为同目录下图片文件的编号
+
+RECORD_DTYPE = np.dtype([
+    ("op", "u1"),
+    ("x0", "<i2"), ("y0", "<i2"), ("x1", "<i2"), ("y1", "<i2"),
+    ("b", "u1"), ("g", "u1"), ("r", "u1"),
+    ("thickness", "u1")
+])
+RECORD_STRUCT = struct.Struct("<BhhhhBBBB")
+
+FINISHED_SUFFIX = ".strokes"
+PART_SUFFIX = ".strokes.part"
+
+def room_directory(root, room_id):
+    """房间的保存目录，房间号含有特殊字符时使用其十六进制编码"""
+    if re.fullmatch(r"[A-Za-z0-9_\-]+", room_id):
+        name = room_id
+    else:
+        name = "x" + room_id.encode('utf-8').hex()
+    return os.path.join(root, name)
+
+def image_path(log_path, index):
+    """OP_IMAGE记录引用的图片文件"""
+    base = log_path[:-len(PART_SUFFIX)] if log_path.endswith(PART_SUFFIX) else log_path[:-len(FINISHED_SUFFIX)]
+    return f"{base}.{index}.png"
+
+def round_node(name):
+    """日志文件名中的节点名称，单进程运行时为空字符串"""
+    stem = name.split(".", 1)[0]
+    return stem.partition("-")[2]
+
+def read_log(path):
+    """读取日志，返回 (词语, 记录数组)；记录数组为只读内存映射，末尾不完整的记录被忽略"""
+    with open(path, "rb") as f:
+        magic, version, word_size = HEADER_STRUCT.unpack(f.read(HEADER_STRUCT.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"不是笔画日志文件: {path}")
+        word = f.read(word_size).decode('utf-8')
+    offset = HEADER_STRUCT.size + word_size
+    count = (os.path.getsize(path) - offset) // RECORD_DTYPE.itemsize
+    if count == 0:
+        return word, np.zeros(0, dtype=RECORD_DTYPE)
+    return word, np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=offset, shape=(count,))
+
+def apply_record(board, record, path):
+    """把一条记录应用到画布存储上，path为日志路径（用于查找图片）"""
+    op = record["op"]
+    if op == OP_SEGMENT:
+        board.draw_line(
+            (int(record["x0"]), int(record["y0"])),
+            (int(record["x1"]), int(record["y1"])),
+            (int(record["b"]), int(record["g"]), int(record["r"])),
+            int(record["thickness"])
+        )
+    elif op == OP_CLEAR:
+        board.clear()
+    elif op == OP_IMAGE:
+        image = cv2.imread(image_path(path, int(record["x0"])), cv2.IMREAD_COLOR)
+        if image is not None:
+            board.load_bgr(image)
+
+def replay(path, board):
+    """把日志中的记录依次应用到画布存储上，返回词语"""
+    word, records = read_log(path)
+    for record in records:
+        apply_record(board, record, path)
+    return word
+
+def rasterize(path, height=480, width=640):
+    """把一局的日志绘制为BGR图片"""
+    from tyf_canvas import BGRCanvas
+    board = BGRCanvas(height, width)
+    replay(path, board)
+    return board.to_bgr()
+
+class StrokeLog:
+    """一个房间的笔画日志，由游戏状态在事件循环中记录，写入操作攒成批次交给线程池执行"""
+    def __init__(self, room_id, root=DRAWINGS_DIR, node=""):
+        self.directory = room_directory(root, room_id)
+        self.node = node  # 节点名称，为空时文件名不带节点名称
+        self.path = None  # 当前这一局的 .part 文件
+        self.pending = bytearray()  # 尚未写入当前文件的记录
+        self.operations = []  # 尚未执行的文件操作
+        self.images = 0  # 当前这一局的图片数
+        self.last_flush = time.monotonic()
+
+    def start_round(self, word):
+        """结束当前这一局并开始新的一局"""
+        self.finish_round()
+        name = f"{time.time_ns() // 1_000_000}"
+        if self.node:
+            name += f"-{self.node}"
+        self.path = os.path.join(self.directory, name + PART_SUFFIX)
+        word_bytes = word.encode('utf-8')
+        self.pending += HEADER_STRUCT.pack(MAGIC, VERSION, len(word_bytes)) + word_bytes
+        self.images = 0
+
+    def finish_round(self):
+        """当前这一局的记录写完后把文件改名为 .strokes"""
+        if self.path is None:
+            return
+        self.take_pending()
+        self.operations.append(("rename", self.path, self.path[:-len(PART_SUFFIX)] + FINISHED_SUFFIX))
+        self.path = None
+
+    def recover(self):
+        """查找本节点上次崩溃时进行中的一局，较早的 .part 文件直接标记为已结束；返回最新一局的路径
+        
+        其他节点的文件可能仍在写入，不做任何处理。
+        """
+        if not os.path.isdir(self.directory):
+            return None
+        parts = sorted(
+            name for name in os.listdir(self.directory)
+            if name.endswith(PART_SUFFIX) and round_node(name) == self.node
+        )
+        for name in parts[:-1]:
+            path = os.path.join(self.directory, name)
+            os.replace(path, path[:-len(PART_SUFFIX)] + FINISHED_SUFFIX)
+        if not parts:
+            return None
+        self.path = os.path.join(self.directory, parts[-1])
+        base = parts[-1][:-len(PART_SUFFIX)] + "."
+        self.images = sum(1 for name in os.listdir(self.directory) if name.startswith(base) and name.endswith(".png"))
+        return self.path
+
+    def segment(self, segment):
+        # 坐标超出记录范围的部分本来就在画布之外，截断即可
+        x0, y0, x1, y1 = (min(max(v, -32768), 32767) for v in (*segment["from"], *segment["to"]))
+        self.pending += RECORD_STRUCT.pack(OP_SEGMENT, x0, y0, x1, y1, *segment["color"], min(segment["thickness"], 255))
+
+    def clear(self):
+        self.pending += RECORD_STRUCT.pack(OP_CLEAR, 0, 0, 0, 0, 0, 0, 0, 0)
+
+    def image(self, data: bytes):
+        """记录整幅画面（PNG数据）"""
+        if self.path is None:
+            return
+        self.take_pending()
+        self.operations.append(("write", image_path(self.path, self.images), bytes(data)))
+        self.pending += RECORD_STRUCT.pack(OP_IMAGE, self.images, 0, 0, 0, 0, 0, 0, 0)
+        self.images += 1
+
+    def take_pending(self):
+        if self.pending and self.path is not None:
+            self.operations.append(("append", self.path, bytes(self.pending)))
+        self.pending = bytearray()
+
+    def due(self):
+        """是否到了批量写入的时间"""
+        return (self.pending or self.operations) and time.monotonic() - self.last_flush >= STROKE_LOG_FLUSH_INTERVAL
+
+    def take_batch(self):
+        """取出待执行的文件操作，在事件循环中调用"""
+        self.take_pending()
+        operations = self.operations
+        self.operations = []
+        self.last_flush = time.monotonic()
+        return operations
+
+    def write_batch(self, operations):
+        """执行一批文件操作并fsync，在线程池中调用；返回本批中结束的各局日志路径"""
+        os.makedirs(self.directory, exist_ok=True)
+        finished = []
+        for kind, path, data in operations:
+            if kind == "append":
+                with open(path, "ab") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            elif kind == "write":
+                with open(path, "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            elif kind == "rename":
+                if os.path.exists(path):
+                    os.replace(path, data)
+                    finished.append(data)
+        return finished
+
+# 把一局的日志导出为图片，例如：python tyf_strokelog.py drawings/default/1700000000000.strokes out.png
+if __name__ == "__main__":
+    word, records = read_log(sys.argv[1])
+    print(f"词语: {word}，记录数: {len(records)}")
+    if len(sys.argv) > 2:
+        cv2.imwrite(sys.argv[2], rasterize(sys.argv[1]))
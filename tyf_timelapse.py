@@ -0,0 +1,125 @@
+import asyncio
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from tyf_metrics import timelapse_jobs
+from tyf_strokelog import FINISHED_SUFFIX, HEADER_STRUCT, RECORD_DTYPE, apply_record, read_log
+
+# 延时回放：每局结束后在进程池中把笔画日志渲染为动画（GIF，未安装PIL时为MP4）和最终画面PNG，
+# 输出文件与日志放在同一目录。渲染不在事件循环中进行，排队的任务数有上限，系统负载过高时跳过
+
+# 渲染进程数，0为不渲染
+TIMELAPSE_WORKERS = int(os.environ.get("TIMELAPSE_WORKERS", 1))
+# 排队和进行中的渲染任务上限，超过时跳过新的任务
+TIMELAPSE_QUEUE_SIZE = int(os.environ.get("TIMELAPSE_QUEUE_SIZE", 4))
+# 每个CPU核心的1分钟平均负载超过此值时跳过渲染
+TIMELAPSE_MAX_LOAD = float(os.environ.get("TIMELAPSE_MAX_LOAD", 0.75))
+# 动画的最多帧数、帧率和缩放比例
+TIMELAPSE_MAX_FRAMES = 120
+TIMELAPSE_FPS = 10
+TIMELAPSE_SCALE = 0.5
+# 动画最后一帧额外停留的秒数
+TIMELAPSE_HOLD = 2
+
+def render_round(path, max_frames=TIMELAPSE_MAX_FRAMES, fps=TIMELAPSE_FPS, scale=TIMELAPSE_SCALE):
+    """渲染一局的延时动画和最终画面，在渲染进程中执行；返回输出文件路径列表"""
+    from tyf_canvas import BGRCanvas
+    _, records = read_log(path)
+    board = BGRCanvas()
+    step = max(math.ceil(len(records) / max_frames), 1)
+    size = (int(board.width * scale), int(board.height * scale))
+    frames = [cv2.resize(board.to_bgr(), size, interpolation=cv2.INTER_AREA)]
+    for i, record in enumerate(records, 1):
+        apply_record(board, record, path)
+        if i % step == 0 or i == len(records):
+            frames.append(cv2.resize(board.to_bgr(), size, interpolation=cv2.INTER_AREA))
+
+    base = path[:-len(FINISHED_SUFFIX)]
+    outputs = [base + ".png"]
+    cv2.imwrite(outputs[0], board.to_bgr())
+    outputs.append(write_animation(base, frames, fps))
+    return outputs
+
+def write_animation(base, frames, fps):
+    """写出动画，优先使用GIF，未安装PIL时写MP4"""
+    hold = [frames[-1]] * (TIMELAPSE_HOLD * fps)
+    try:
+        from PIL import Image
+    except ImportError:
+        output = base + ".mp4"
+        height, width = frames[0].shape[:2]
+        writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+        for frame in frames + hold:
+            writer.write(frame)
+        writer.release()
+        return output
+    output = base + ".gif"
+    # 画面颜色很少，使用自适应调色板即可
+    images = [Image.fromarray(frame[:, :, ::-1]).convert("P", palette=Image.ADAPTIVE, colors=32) for frame in frames]
+    durations = [1000 // fps] * len(images)
+    durations[-1] = TIMELAPSE_HOLD * 1000
+    images[0].save(output, save_all=True, append_images=images[1:], duration=durations, loop=0, optimize=True)
+    return output
+
+def system_overloaded():
+    """每个CPU核心的平均负载是否超过上限；无法获取负载时认为未超过"""
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return False
+    return load / (os.cpu_count() or 1) > TIMELAPSE_MAX_LOAD
+
+class TimelapseRenderer:
+    """把渲染任务交给进程池，事件循环只负责提交和记录结果"""
+    def __init__(self, workers=TIMELAPSE_WORKERS, queue_size=TIMELAPSE_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = None
+        self.pending = 0  # 排队和进行中的任务数
+
+    def submit(self, path):
+        """提交一局的渲染任务，被跳过时返回None"""
+        if self.workers <= 0:
+            return None
+        try:
+            if os.path.getsize(path) < HEADER_STRUCT.size + RECORD_DTYPE.itemsize:
+                # 这一局什么都没画
+                return None
+        except OSError:
+            return None
+        if self.pending >= self.queue_size:
+            timelapse_jobs.inc("skipped_queue")
+            return None
+        if system_overloaded():
+            timelapse_jobs.inc("skipped_load")
+            return None
+        if self.executor is None:
+            # 使用spawn启动渲染进程，不继承服务器的线程和连接
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self.pending += 1
+        future = asyncio.get_running_loop().run_in_executor(self.executor, render_round, path)
+        future.add_done_callback(self.done)
+        return future
+
+    def done(self, future):
+        self.pending -= 1
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            timelapse_jobs.inc("failed")
+            print(f"渲染延时回放失败: {error}")
+        else:
+            timelapse_jobs.inc("rendered")
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+# 进程内共享的渲染器
+timelapse_renderer = TimelapseRenderer()
@@ -0,0 +1,247 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from tyf_match import PINYIN_AVAILABLE, spell
+
+# 词库：从文本文件或目录加载，编译为按（类别, 难度）分组的紧凑索引，并缓存到磁盘
+# 文本格式为每行一个词，可选用制表符分隔类别、难度（数字）和别名（以=开头，逗号分隔）：
+#   苹果
+#   苹果\t2
+#   苹果\t水果\t2
+#   自行车\t2\t=单车,脚踏车,zixingche
+# 别名（包括拼音）在判断猜测时与词语本身同等对待，见 tyf_match
+# 目录中的每个 .txt 文件以文件名作为其中词语的默认类别
+# 源文件未修改时直接读取编译缓存，几万个词也几乎不增加启动时间
+# 词语的拼音（猜词匹配用，生成很慢）在编译时一起生成并写入缓存
+
+# 词库位置，可以是文件或目录
+WORD_BANK_PATH = os.environ.get("WORD_BANK_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "words"))
+# 编译缓存的格式版本，修改缓存格式时递增
+CACHE_VERSION = 3
+DEFAULT_CATEGORY = "默认"
+DEFAULT_DIFFICULTY = 1
+
+# 未找到词库文件时使用的内置词库
+BUILTIN_WORDS = [
+    "苹果", "香蕉", "猫", "狗", "房子", "汽车", "飞机", "船", "树", "花",
+    "太阳", "月亮", "星星", "雨伞", "眼镜", "帽子", "鞋子", "衣服", "手机", "电脑",
+    "电视", "冰箱", "洗衣机", "自行车", "摩托车", "火车", "火箭", "足球", "篮球", "乒乓球"
+]
+
+class WordBank:
+    """编译后的词库
+
+    所有词语按（类别, 难度）排序后拼接为一段UTF-8数据，offsets[i]:offsets[i+1]为第i个词，
+    每个分组是一段连续的下标区间，因此取词和按分组筛选都不需要额外的数据结构。
+    """
+    def __init__(self, data, offsets, categories, groups, aliases=None, spellings=None):
+        self.data = data  # 所有词语拼接后的UTF-8字节
+        self.offsets = offsets  # uint32数组，长度为词数+1
+        self.categories = categories  # 类别名列表
+        self.groups = groups  # (类别下标, 难度) -> (起始下标, 结束下标)
+        self.aliases = aliases or {}  # 词语下标 -> 别名列表，只保存有别名的词
+        self.spellings = spellings  # 每个词语的拼音列表，未安装pypinyin时为None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def word(self, index):
+        return self.data[self.offsets[index]:self.offsets[index + 1]].decode('utf-8')
+
+    def words(self):
+        """依次返回所有词语"""
+        return [self.word(i) for i in range(len(self))]
+
+    def ranges(self, category=None, difficulty=None):
+        """返回符合条件的下标区间列表，条件为None时不筛选"""
+        return [
+            bounds for (category_index, level), bounds in self.groups.items()
+            if (category is None or self.categories[category_index] == category)
+            and (difficulty is None or level == difficulty)
+        ]
+
+    def indices(self, category=None, difficulty=None):
+        """返回符合条件的所有词语下标"""
+        ranges = self.ranges(category, difficulty)
+        if not ranges:
+            return np.zeros(0, dtype=np.uint32)
+        return np.concatenate([np.arange(start, end, dtype=np.uint32) for start, end in ranges])
+
+    @classmethod
+    def compile(cls, entries):
+        """由 (词语, 类别, 难度, 别名) 列表编译词库，重复的词只保留第一次出现"""
+        seen = set()
+        unique = []
+        for word, category, difficulty, aliases in entries:
+            if word not in seen:
+                seen.add(word)
+                unique.append((word, category, difficulty, tuple(aliases)))
+        categories = sorted({entry[1] for entry in unique})
+        category_ids = {category: i for i, category in enumerate(categories)}
+        unique.sort(key=lambda entry: (category_ids[entry[1]], entry[2]))
+
+        encoded = [entry[0].encode('utf-8') for entry in unique]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+        offsets[1:] = np.cumsum([len(word) for word in encoded], dtype=np.uint64)
+        groups = {}
+        for i, (_, category, difficulty, _) in enumerate(unique):
+            key = (category_ids[category], difficulty)
+            start, _ = groups.get(key, (i, i))
+            groups[key] = (start, i + 1)
+        aliases = {i: list(entry[3]) for i, entry in enumerate(unique) if entry[3]}
+        spellings = [spell(entry[0]) for entry in unique] if PINYIN_AVAILABLE else None
+        return cls(b"".join(encoded), offsets, categories, groups, aliases, spellings)
+
+    def save(self, path, signature):
+        """写入编译缓存，signature用于判断源文件是否修改过"""
+        meta = {
+            "version": CACHE_VERSION,
+            "signature": signature,
+            "categories": self.categories,
+            "groups": [[category, level, start, end] for (category, level), (start, end) in self.groups.items()],
+            "aliases": [[index, aliases] for index, aliases in self.aliases.items()],
+            "pinyin": self.spellings is not None
+        }
+        # 拼音只含小写字母，按行拼接保存
+        spellings = "\n".join(self.spellings or ()).encode('utf-8')
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                meta=np.frombuffer(json.dumps(meta, ensure_ascii=False).encode('utf-8'), dtype=np.uint8),
+                data=np.frombuffer(self.data, dtype=np.uint8),
+                offsets=self.offsets,
+                spellings=np.frombuffer(spellings, dtype=np.uint8)
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_cache(cls, path, signature):
+        """读取编译缓存，缓存不存在或已过期时返回None；编译后才安装或卸载了pypinyin时缓存也已过期"""
+        try:
+            with np.load(path, allow_pickle=False) as cache:
+                meta = json.loads(cache["meta"].tobytes().decode('utf-8'))
+                if meta["version"] != CACHE_VERSION or meta["signature"] != signature:
+                    return None
+                if meta["pinyin"] != PINYIN_AVAILABLE:
+                    return None
+                groups = {(category, level): (start, end) for category, level, start, end in meta["groups"]}
+                aliases = {index: aliases for index, aliases in meta["aliases"]}
+                spellings = cache["spellings"].tobytes().decode('utf-8').split("\n") if meta["pinyin"] else None
+                return cls(cache["data"].tobytes(), cache["offsets"], meta["categories"], groups, aliases, spellings)
+        except (OSError, ValueError, KeyError):
+            return None
+
+def source_files(path):
+    """词库的源文件列表"""
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.endswith(".txt")
+        )
+    if os.path.isfile(path):
+        return [path]
+    return []
+
+def source_signature(files):
+    """源文件的路径、大小和修改时间，任何一项变化都会使缓存失效"""
+    signature = []
+    for file in files:
+        stat = os.stat(file)
+        signature.append([os.path.basename(file), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+def parse_words(file, default_category=DEFAULT_CATEGORY):
+    """解析一个词库文本文件，返回 (词语, 类别, 难度, 别名) 列表，#开头的行为注释"""
+    entries = []
+    with open(file, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            word, *fields = [field.strip() for field in line.split("\t")]
+            category, difficulty, aliases = default_category, DEFAULT_DIFFICULTY, ()
+            for field in fields:
+                if field.isdigit():
+                    difficulty = int(field)
+                elif field.startswith("="):
+                    aliases = tuple(alias.strip() for alias in field[1:].split(",") if alias.strip())
+                elif field:
+                    category = field
+            entries.append((word, category, difficulty, aliases))
+    return entries
+
+def cache_path_for(path):
+    """编译缓存的位置：目录词库放在目录内，文件词库放在文件旁边"""
+    if os.path.isdir(path):
+        return os.path.join(path, ".wordbank.npz")
+    return path + ".npz"
+
+def load_word_bank(path=WORD_BANK_PATH):
+    """加载词库，优先读取编译缓存；找不到词库文件时使用内置词库"""
+    files = source_files(path)
+    if not files:
+        return WordBank.compile([(word, DEFAULT_CATEGORY, DEFAULT_DIFFICULTY, ()) for word in BUILTIN_WORDS])
+    signature = source_signature(files)
+    cache_path = cache_path_for(path)
+    bank = WordBank.load_cache(cache_path, signature)
+    if bank is not None:
+        return bank
+
+    entries = []
+    for file in files:
+        default_category = os.path.splitext(os.path.basename(file))[0] if len(files) > 1 or os.path.isdir(path) else DEFAULT_CATEGORY
+        entries.extend(parse_words(file, default_category))
+    if not entries:
+        entries = [(word, DEFAULT_CATEGORY, DEFAULT_DIFFICULTY, ()) for word in BUILTIN_WORDS]
+    bank = WordBank.compile(entries)
+    try:
+        bank.save(cache_path, signature)
+    except OSError as e:
+        print(f"无法写入词库缓存: {e}")
+    return bank
+
+class WordDeck:
+    """从词库中不重复地抽词：洗好一副牌后依次发出，发完再重新洗牌，每次抽词O(1)"""
+    def __init__(self, bank, category=None, difficulty=None, rng=None):
+        self.bank = bank
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.cards = bank.indices(category, difficulty)
+        if len(self.cards) == 0:
+            # 没有符合条件的词时使用整个词库
+            self.cards = bank.indices()
+        self.position = len(self.cards)
+        self.last = None
+
+    def __len__(self):
+        return len(self.cards)
+
+    def shuffle(self):
+        self.rng.shuffle(self.cards)
+        # 避免新一副牌的第一张恰好是上一副的最后一张
+        if len(self.cards) > 1 and self.cards[0] == self.last:
+            self.cards[0], self.cards[-1] = self.cards[-1], self.cards[0]
+        self.position = 0
+
+    def draw(self):
+        """抽出下一个词"""
+        if self.position >= len(self.cards):
+            self.shuffle()
+        self.last = self.cards[self.position]
+        self.position += 1
+        return self.bank.word(int(self.last))
+
+_default_word_bank = None
+_default_word_bank_lock = threading.Lock()
+
+def default_word_bank():
+    """进程内共享的词库，第一次使用时加载；可以在其他线程中调用"""
+    global _default_word_bank
+    if _default_word_bank is None:
+        with _default_word_bank_lock:
+            if _default_word_bank is None:
+                _default_word_bank = load_word_bank()
+    return _default_word_bank